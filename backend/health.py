@@ -0,0 +1,71 @@
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root))
+
+from backend.metrics import send_metrics
+from backend.smtp_pool import get_smtp_pool
+
+load_dotenv()
+
+KEYS_DIR = os.path.join("keys", "private")
+READY_MAX_THREAD_USAGE = float(os.getenv('READY_MAX_THREAD_USAGE', 0.9))
+READY_MAX_SEND_QUEUE = int(os.getenv('READY_MAX_SEND_QUEUE', 50))
+READY_MAX_SMTP_POOL_USAGE = float(os.getenv('READY_MAX_SMTP_POOL_USAGE', 0.9))
+READY_MAX_P95_SECONDS = float(os.getenv('READY_MAX_P95_SECONDS', 30))
+# Only sends of this recent period count for the p95, so the service recovers once they age out
+READY_LATENCY_WINDOW_SECONDS = float(os.getenv('READY_LATENCY_WINDOW_SECONDS', 300))
+
+
+def check_key_store() -> str | None:
+    """
+    Returns the error if the private keys can not be read or written.
+    The probe is read-only, a missing key directory is reported instead of created.
+    """
+    if not os.path.isdir(KEYS_DIR):
+        return f"{KEYS_DIR} does not exist"
+    try:
+        os.listdir(KEYS_DIR)
+        if not os.access(KEYS_DIR, os.R_OK | os.W_OK):
+            return f"{KEYS_DIR} is not readable and writable"
+    except OSError as e:
+        return str(e)
+    return None
+
+
+def check_readiness(threads_in_use: int, threads_total: int) -> dict:
+    """
+    Collects the load signals and compares them with the READY_* thresholds.
+    The thread pool numbers come from the caller, since they belong to the event loop.
+    """
+    smtp_pool = get_smtp_pool().stats()
+    p95 = send_metrics.p95(READY_LATENCY_WINDOW_SECONDS)
+    signals = {
+        "key_store": {"error": check_key_store()},
+        "threads": {"in_use": threads_in_use, "total": threads_total, "usage": threads_in_use / threads_total},
+        "send_queue": {"depth": send_metrics.in_flight},
+        "smtp_pool": smtp_pool,
+        "latency": {"p95_seconds": p95, "window_seconds": READY_LATENCY_WINDOW_SECONDS},
+    }
+
+    reasons = []
+    if signals["key_store"]["error"]:
+        reasons.append("key store is not accessible")
+    if signals["threads"]["usage"] > READY_MAX_THREAD_USAGE:
+        reasons.append("thread pool is saturated")
+    if send_metrics.in_flight > READY_MAX_SEND_QUEUE:
+        reasons.append("send queue is too deep")
+    if smtp_pool["usage"] > READY_MAX_SMTP_POOL_USAGE:
+        reasons.append("SMTP pool is saturated")
+    if p95 is not None and p95 > READY_MAX_P95_SECONDS:
+        reasons.append("p95 send latency is too high")
+
+    return {
+        "status": "not-ready" if reasons else "ready",
+        "reasons": reasons,
+        "signals": signals,
+    }
@@ -0,0 +1,51 @@
+"""
+Manage the signing keys of a user.
+
+    python backend/keytool.py rotate user@example.com
+    python backend/keytool.py list user@example.com
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root))
+
+from backend.rsa import RSA
+
+
+def rotate(email: str):
+    if RSA.is_user_key_present(email):
+        print(f"Retiring key {RSA(email).kid}")
+    kid = RSA.rotate(email)
+    print(f"New key {kid} for {email}")
+
+
+def list_keys(email: str):
+    if not RSA.is_user_key_present(email):
+        print(f"No key found for {email}")
+        return
+
+    current = RSA(email).kid
+    for name in sorted(os.listdir(RSA.get_public_key_dir(email))):
+        if name.endswith(".pem"):
+            kid = name[:-len(".pem")]
+            print(f"{kid} {'current' if kid == current else 'retired'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the signing keys of a user.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rotate', help="Replace the signing key, the old public key stays verifiable").add_argument('email')
+    subparsers.add_parser('list', help="List the current and retired key IDs").add_argument('email')
+    args = parser.parse_args()
+
+    if args.command == 'rotate':
+        rotate(args.email)
+    else:
+        list_keys(args.email)
+
+
+if __name__ == "__main__":
+    main()
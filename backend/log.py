@@ -0,0 +1,99 @@
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Share of DEBUG records that are kept, the rest is dropped before it is queued
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.1))
+
+# Correlation ID of the request or SMTP transaction being handled
+request_id = contextvars.ContextVar('request_id', default=None)
+
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+_listener = None
+_queue_handler = None
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record. Fields passed with `extra` are added as keys.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, 'request_id', None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = LOG_LEVEL, debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE, stream=None):
+    """
+    Route all records through a queue to a background thread that writes them to
+    `stream` (stdout by default), so the logging threads never wait for the output.
+    Command line tools that print their result to stdout log to stderr instead.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    # The filters run on the logging thread, where the request ID is known
+    _queue_handler = QueueHandler(log_queue)
+    _queue_handler.addFilter(RequestIdFilter())
+    _queue_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+
+    stream_handler = logging.StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Write the queued records and stop the background thread.
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    _listener = None
+    _queue_handler = None
@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class SendMetrics:
+    """
+    Sends in progress and the latency of the most recent sends, with the time they finished.
+    """
+
+    def __init__(self, window: int = 200):
+        self.in_flight = 0
+        self.__latencies = deque(maxlen=window)
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        with self.__lock:
+            self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.__lock:
+                self.in_flight -= 1
+                self.__latencies.append((time.monotonic(), elapsed))
+
+    def p95(self, max_age: float = None) -> float | None:
+        """
+        The p95 latency of the recent sends, only of those that finished in the last
+        `max_age` seconds if it is given. None if there is no such send.
+        """
+        oldest = time.monotonic() - max_age if max_age is not None else None
+        with self.__lock:
+            latencies = sorted(
+                latency for finished, latency in self.__latencies if oldest is None or finished >= oldest
+            )
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+
+send_metrics = SendMetrics()
@@ -0,0 +1,331 @@
+import base64
+import binascii
+import re
+import smtplib
+from email.header import Header
+from email.utils import encode_rfc2231, formatdate, make_msgid, quote
+from uuid import uuid4
+
+CRLF = b'\r\n'
+CHUNK_SIZE = 64 * 1024
+# 57 input bytes encode to one 76 character base64 line
+BASE64_LINE_BYTES = 57
+# Bytes quoted-printable keeps as they are, everything else takes three bytes
+QP_SAFE_BYTES = bytes(range(33, 127)).replace(b'=', b'') + b' \t\r\n'
+# A MIME type without parameters, like "image/png"
+CONTENT_TYPE_PATTERN = re.compile(r"[a-z0-9!#$&^_.+-]+/[a-z0-9!#$&^_.+-]+")
+CONTROL_CHARACTERS = re.compile(r"[\x00-\x1f\x7f]")
+
+
+def encode_header(name: str, value: str) -> bytes:
+    charset = 'us-ascii' if value.isascii() else 'utf-8'
+    encoded = Header(value, charset, header_name=name).encode(linesep='\r\n')
+    return f"{name}: {encoded}".encode('ascii') + CRLF
+
+
+def normalize_content_type(content_type: str | None) -> str:
+    """
+    The MIME type without parameters, application/octet-stream if it is not a valid one.
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return content_type if CONTENT_TYPE_PATTERN.fullmatch(content_type) else 'application/octet-stream'
+
+
+def encode_filename(filename: str) -> bytes:
+    if CONTROL_CHARACTERS.search(filename):
+        raise ValueError(f"Invalid filename: {filename!r}")
+    if filename.isascii():
+        return f'filename="{quote(filename)}"'.encode('ascii')
+    return f"filename*={encode_rfc2231(filename, 'utf-8')}".encode('ascii')
+
+
+def normalize_line_endings(data: bytes) -> bytes:
+    return data.replace(CRLF, b'\n').replace(b'\r', b'\n')
+
+
+def encode_qp(data: bytes) -> bytes:
+    """
+    Quoted-printable encode data with CRLF line breaks. CRLF, bare CR and bare LF
+    are all line breaks. The result ends with a line break (a soft one if the data
+    does not end with one), so independently encoded pieces can be concatenated.
+    """
+    if not data:
+        return b''
+    # b2a_qp leaves a bare CR as it is, which is not allowed in a message
+    encoded = binascii.b2a_qp(normalize_line_endings(data), istext=True).replace(b'\n', CRLF)
+    if not encoded.endswith(CRLF):
+        encoded += b'=' + CRLF
+    return encoded
+
+
+def estimate_qp_size(data: bytes) -> int:
+    unsafe = len(data.translate(None, QP_SAFE_BYTES))
+    size = len(data) + 2 * unsafe
+    # Soft line breaks every 75 characters
+    return size + size // 75 * 3
+
+
+def base64_size(size: int) -> int:
+    return -(-size // BASE64_LINE_BYTES) * (BASE64_LINE_BYTES * 4 // 3 + 2)
+
+
+class EncodedSegment:
+    """
+    Static text whose encoded forms are computed once and reused by every message.
+    """
+
+    def __init__(self, text: str, charset: str = 'utf-8'):
+        self.text = text
+        self.raw = text.encode(charset)
+        self.qp = encode_qp(self.raw)
+
+
+class Base64Encoder:
+    """
+    Base64 encodes a stream of chunks into 76 character lines, carrying the
+    bytes that do not fill a whole line over to the next chunk.
+    """
+
+    def __init__(self, write):
+        self.__write = write
+        self.__rest = b''
+
+    def feed(self, data: bytes):
+        data = self.__rest + data
+        usable = len(data) - len(data) % BASE64_LINE_BYTES
+        self.__rest = data[usable:]
+        if usable:
+            self.__write(base64.encodebytes(data[:usable]).replace(b'\n', CRLF))
+
+    def close(self):
+        if self.__rest:
+            self.__write(base64.encodebytes(self.__rest).replace(b'\n', CRLF))
+            self.__rest = b''
+
+
+class QuotedPrintableEncoder:
+    """
+    Quoted-printable encodes a stream of chunks, carrying a CR at the end of a
+    chunk over to the next one, so a CRLF split between chunks stays one line break.
+    """
+
+    def __init__(self, write):
+        self.__write = write
+        self.__rest = b''
+
+    def feed(self, data: bytes):
+        data = self.__rest + data
+        if data.endswith(b'\r'):
+            data, self.__rest = data[:-1], b'\r'
+        else:
+            self.__rest = b''
+        self.__write(encode_qp(data))
+
+    def close(self):
+        self.__write(encode_qp(self.__rest))
+        self.__rest = b''
+
+
+class MimePart:
+    """
+    A leaf part whose content is a sequence of str, bytes, `EncodedSegment` or
+    binary file objects. The content is read and encoded chunk by chunk when written.
+    Text parts use quoted-printable or base64, whichever is smaller.
+    A part with a content ID is inline, the HTML refers to it with `cid:`.
+    """
+
+    def __init__(self, content_type: str, content: list, charset: str = None, filename: str = None,
+                 content_id: str = None):
+        self.content_type = content_type
+        self.content = content
+        self.charset = charset
+        self.filename = filename
+        self.content_id = content_id
+
+    def iter_content(self):
+        for item in self.content:
+            if isinstance(item, str):
+                yield item.encode(self.charset or 'utf-8')
+            elif isinstance(item, bytes):
+                yield item
+            elif isinstance(item, EncodedSegment):
+                yield item.raw
+            else:
+                item.seek(0)
+                while chunk := item.read(CHUNK_SIZE):
+                    yield chunk
+
+    def choose_encoding(self) -> str:
+        if not self.charset:
+            return 'base64'
+
+        size = 0
+        qp_size = 0
+        for item in self.content:
+            if isinstance(item, EncodedSegment):
+                size += len(item.raw)
+                qp_size += len(item.qp)
+            else:
+                for chunk in MimePart(self.content_type, [item], self.charset).iter_content():
+                    size += len(chunk)
+                    qp_size += estimate_qp_size(chunk)
+        return 'quoted-printable' if qp_size <= base64_size(size) else 'base64'
+
+    def write_headers(self, write, encoding: str):
+        content_type = self.content_type
+        if self.charset:
+            content_type += f'; charset="{self.charset}"'
+        write(f"Content-Type: {content_type}".encode('ascii') + CRLF)
+        write(b'MIME-Version: 1.0' + CRLF)
+        write(f"Content-Transfer-Encoding: {encoding}".encode('ascii') + CRLF)
+        if self.content_id:
+            write(f"Content-ID: <{self.content_id}>".encode('ascii') + CRLF)
+        if self.filename:
+            disposition = b'inline' if self.content_id else b'attachment'
+            write(b'Content-Disposition: ' + disposition + b'; ' + encode_filename(self.filename) + CRLF)
+        write(CRLF)
+
+    def write_to(self, write):
+        encoding = self.choose_encoding()
+        self.write_headers(write, encoding)
+        if encoding == 'quoted-printable':
+            for item in self.content:
+                if isinstance(item, EncodedSegment):
+                    write(item.qp)
+                else:
+                    encoder = QuotedPrintableEncoder(write)
+                    for chunk in MimePart(self.content_type, [item], self.charset).iter_content():
+                        encoder.feed(chunk)
+                    encoder.close()
+            return
+
+        encoder = Base64Encoder(write)
+        for chunk in self.iter_content():
+            encoder.feed(chunk)
+        encoder.close()
+
+
+class MultipartPart:
+    """
+    A multipart part nested in a message, like a multipart/related part that holds
+    the HTML together with its inline images.
+    """
+
+    def __init__(self, subtype: str, parts: list):
+        self.subtype = subtype
+        self.parts = parts
+        self.boundary = f"==============={uuid4().hex}=="
+
+    def write_headers(self, write):
+        write(f'Content-Type: multipart/{self.subtype}; boundary="{self.boundary}"'.encode('ascii') + CRLF)
+        write(b'MIME-Version: 1.0' + CRLF)
+
+    def write_parts(self, write):
+        boundary = self.boundary.encode('ascii')
+        for part in self.parts:
+            write(b'--' + boundary + CRLF)
+            part.write_to(write)
+            write(CRLF)
+        write(b'--' + boundary + b'--' + CRLF)
+
+    def write_to(self, write):
+        self.write_headers(write)
+        write(CRLF)
+        self.write_parts(write)
+
+
+class StreamingMessage(MultipartPart):
+    """
+    A multipart message that is serialised straight to a writer, so large
+    bodies and attachments never have to be held in memory as a whole.
+    """
+
+    def __init__(self, subtype: str, headers: list[tuple[str, str]], parts: list):
+        super().__init__(subtype, parts)
+        self.headers = headers
+
+    def write_to(self, write):
+        self.write_headers(write)
+        write(encode_header('Date', formatdate(localtime=True)))
+        write(encode_header('Message-ID', make_msgid()))
+        for name, value in self.headers:
+            write(encode_header(name, value))
+        write(CRLF)
+        self.write_parts(write)
+
+    def as_bytes(self) -> bytes:
+        chunks = []
+        self.write_to(chunks.append)
+        return b''.join(chunks)
+
+
+class SMTPDataWriter:
+    """
+    Buffers the DATA payload, applies dot-stuffing and sends it to the socket
+    in chunks.
+    """
+
+    def __init__(self, server: smtplib.SMTP, buffer_size: int = CHUNK_SIZE):
+        self.__server = server
+        self.__buffer = bytearray()
+        self.__buffer_size = buffer_size
+        self.__at_line_start = True
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        data = data.replace(b'\n.', b'\n..')
+        if self.__at_line_start and data.startswith(b'.'):
+            data = b'.' + data
+        self.__at_line_start = data.endswith(b'\n')
+        self.__buffer += data
+        if len(self.__buffer) >= self.__buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.__buffer:
+            self.__server.send(bytes(self.__buffer))
+            self.__buffer.clear()
+
+    def finish(self):
+        # The terminating dot must not be dot-stuffed, so it bypasses write()
+        self.__buffer += b'.' + CRLF if self.__at_line_start else CRLF + b'.' + CRLF
+        self.flush()
+
+
+def send_streaming(server: smtplib.SMTP, from_addr: str, to_addrs: list[str], message: StreamingMessage) -> dict:
+    """
+    Send a message like `SMTP.sendmail`, but write the DATA payload straight to
+    the socket instead of building the whole message string first.
+    Returns the refused recipients.
+    """
+    server.ehlo_or_helo_if_needed()
+    code, response = server.mail(from_addr)
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, response, from_addr)
+
+    refused = {}
+    for address in to_addrs:
+        code, response = server.rcpt(address)
+        if code not in (250, 251):
+            refused[address] = (code, response)
+    if len(refused) == len(to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    server.putcmd('data')
+    code, response = server.getreply()
+    if code != 354:
+        server.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    writer = SMTPDataWriter(server)
+    message.write_to(writer.write)
+    writer.finish()
+
+    code, response = server.getreply()
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPDataError(code, response)
+    return refused
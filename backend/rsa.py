@@ -3,13 +3,54 @@ from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 import os
 import base64
+import hashlib
+import logging
+import re
+import threading
 
-def verify_by_base64_key(base64_key: str, ps_message: str, ps_signature: str) -> bool:
-    public_key = serialization.load_pem_public_key(
-        base64.b64decode(base64_key),
-        backend=default_backend()
+logger = logging.getLogger(__name__)
+
+# Key IDs are the first 8 hex characters of the SHA-256 of the public key
+KEY_ID_PATTERN = re.compile(r'[0-9a-f]{8}')
+
+
+def split_signature(signature_str: str) -> tuple[str | None, str]:
+    """
+    Split a signature string into its key ID and hex signature.
+    Signatures created before key rotation have no key ID.
+    """
+    kid, separator, signature = signature_str.rpartition('.')
+    return (kid, signature) if separator else (None, signature_str)
+
+
+def is_valid_key_id(kid: str) -> bool:
+    return isinstance(kid, str) and KEY_ID_PATTERN.fullmatch(kid) is not None
+
+
+def is_valid_key_email(email: str) -> bool:
+    """
+    Whether the email can name a key file. It comes from requests, a path separator
+    would point the key paths outside of the key directory.
+    """
+    if not isinstance(email, str) or not email.strip('@.'):
+        return False
+    return not any(char in email for char in ('/', '\\', '\0'))
+
+
+def get_key_id(public_key) -> str:
+    der = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
     )
-    signature = bytes.fromhex(ps_signature)
+    return hashlib.sha256(der).hexdigest()[:8]
+
+def verify_with_public_key(public_key, ps_message: str, ps_signature: str) -> bool:
+    # The key is given, so the key ID of the signature is not needed
+    _, ps_signature = split_signature(ps_signature)
+    try:
+        signature = bytes.fromhex(ps_signature)
+    except ValueError:
+        return False
     message = ps_message.encode()
     try:
         public_key.verify(
@@ -26,10 +67,20 @@ def verify_by_base64_key(base64_key: str, ps_message: str, ps_signature: str) ->
         return False
 
 
+def verify_by_base64_key(base64_key: str, ps_message: str, ps_signature: str) -> bool:
+    public_key = serialization.load_pem_public_key(
+        base64.b64decode(base64_key),
+        backend=default_backend()
+    )
+    return verify_with_public_key(public_key, ps_message, ps_signature)
+
+
 class RSA:
 
     @staticmethod
     def email_to_filename(email: str):
+        if not is_valid_key_email(email):
+            raise ValueError(f'Invalid email: {email!r}')
         return email.replace("@", "").replace(".", "")
 
     @staticmethod
@@ -45,10 +96,67 @@ class RSA:
         private_key_path = RSA.get_secret_key_path(email)
         return os.path.exists(private_key_path)
 
+    @staticmethod
+    def get_public_key_dir(email: str):
+        filename = RSA.email_to_filename(email)
+        return os.path.join("keys", "public", filename)
+
+    @staticmethod
+    def get_public_key_path(email: str, kid: str):
+        if not is_valid_key_id(kid):
+            raise ValueError(f'Invalid key ID: {kid!r}')
+        return os.path.join(RSA.get_public_key_dir(email), f"{kid}.pem")
+
+    @staticmethod
+    def get_key_version(email: str) -> int | None:
+        """
+        Changes whenever the private key file is replaced, e.g. by a rotation.
+        """
+        try:
+            return os.stat(RSA.get_secret_key_path(email)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def __generate_private_key():
+        return rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=2048,
+            backend=default_backend()
+        )
+
+    @staticmethod
+    def __write_private_key(private_key, private_key_path: str):
+        private_key_pem = private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        # Write next to the old key and swap, so readers never see a partial file
+        tmp_path = f"{private_key_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(private_key_pem)
+        os.replace(tmp_path, private_key_path)
+
+    @staticmethod
+    def rotate(email: str) -> str:
+        """
+        Replace the private key of the user with a new one. The public key of the
+        retired key stays in the public key directory, so older emails still verify.
+        Returns the key ID of the new key.
+        """
+        if RSA.is_user_key_present(email):
+            # Makes sure the public key of the retiring key is exported
+            RSA(email)
+
+        private_key = RSA.__generate_private_key()
+        RSA.__write_private_key(private_key, RSA.get_secret_key_path(email))
+        return RSA(email).kid
+
     def __init__(self, sender_email: str):
         private_key_path = RSA.get_secret_key_path(sender_email)
         if os.path.exists(private_key_path):
-            print("Loading private key from file")
+            logger.debug("Loading private key from file")
             with open(private_key_path, "rb") as f:
                 private_key_pem = f.read()
 
@@ -58,21 +166,24 @@ class RSA:
                 backend=default_backend()
             )
         else:
-            print("Generating new private key")
-            self.__private_key = rsa.generate_private_key(
-                public_exponent=65537,
-                key_size=2048,
-                backend=default_backend()
-            )
-            private_key_pem = self.__private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption()
-            )
-            with open(private_key_path, "wb") as f:
-                f.write(private_key_pem)
+            logger.info("Generating new private key", extra={"email": sender_email})
+            self.__private_key = RSA.__generate_private_key()
+            RSA.__write_private_key(self.__private_key, private_key_path)
 
         self.__public_key = self.__private_key.public_key()
+        self.kid = get_key_id(self.__public_key)
+        self.__export_public_key(sender_email)
+
+    def __export_public_key(self, email: str):
+        public_key_path = RSA.get_public_key_path(email, self.kid)
+        if os.path.exists(public_key_path):
+            return
+        os.makedirs(os.path.dirname(public_key_path), exist_ok=True)
+        # Several processes may export the same key at once
+        tmp_path = f"{public_key_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.__get_public_key())
+        os.replace(tmp_path, public_key_path)
 
     def sign(self, message: str):
         b_message = message.encode()
@@ -98,7 +209,10 @@ class RSA:
 
     def verify(self, signature_str: str, message: str) -> bool:
         b_message = message.encode()
-        signature = bytes.fromhex(signature_str)
+        kid, signature_hex = split_signature(signature_str)
+        if kid is not None and kid != self.kid:
+            return False
+        signature = bytes.fromhex(signature_hex)
         try:
             self.verify_raw(signature, b_message)
             return True
@@ -123,7 +237,7 @@ class RSA:
         signature = self.sign(message)
 
         signature_base64 = signature.hex()
-        signed_message = f"{signature_base64}"
+        signed_message = f"{self.kid}.{signature_base64}"
 
         return signed_message
 
@@ -135,3 +249,66 @@ class RSA:
 
     def get_public_key(self):
         return self.__get_public_key().decode('utf-8')
+
+
+class PublicKeyIndex:
+    """
+    Public keys by (email, key ID). Keys are loaded from the public key directory on
+    first use and kept in memory, so a lookup is a dictionary access afterwards.
+    """
+
+    def __init__(self):
+        self.__keys = {}
+        self.__exported = set()
+        self.__lock = threading.Lock()
+
+    def get(self, email: str, kid: str):
+        # The email and key ID come from the request, they must never reach the filesystem unchecked
+        if not is_valid_key_email(email) or not is_valid_key_id(kid):
+            return None
+
+        index_key = (RSA.email_to_filename(email), kid)
+        public_key = self.__keys.get(index_key)
+        if public_key is not None:
+            return public_key
+
+        public_key_path = RSA.get_public_key_path(email, kid)
+        if not os.path.exists(public_key_path):
+            return None
+
+        with open(public_key_path, "rb") as f:
+            public_key = serialization.load_pem_public_key(f.read(), backend=default_backend())
+        with self.__lock:
+            self.__keys[index_key] = public_key
+        return public_key
+
+    def get_all(self, email: str) -> list:
+        """
+        Every known key of the user, used for signatures that carry no key ID.
+        """
+        if not is_valid_key_email(email):
+            return []
+
+        if email not in self.__exported and RSA.is_user_key_present(email):
+            # Exports the public key of a key that predates key IDs
+            RSA(email)
+            self.__exported.add(email)
+
+        public_key_dir = RSA.get_public_key_dir(email)
+        if not os.path.isdir(public_key_dir):
+            return []
+        kids = [name[:-len(".pem")] for name in os.listdir(public_key_dir) if name.endswith(".pem")]
+        return [self.get(email, kid) for kid in kids if is_valid_key_id(kid)]
+
+
+public_key_index = PublicKeyIndex()
+
+
+def verify_by_key_index(email: str, ps_message: str, ps_signature: str) -> bool:
+    kid, signature = split_signature(ps_signature)
+    if kid is not None:
+        public_key = public_key_index.get(email, kid)
+        return public_key is not None and verify_with_public_key(public_key, ps_message, signature)
+
+    return any(verify_with_public_key(public_key, ps_message, signature)
+               for public_key in public_key_index.get_all(email))
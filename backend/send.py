@@ -1,54 +1,259 @@
+"""
+Send a JSONL file of send records through the signer.
+
+Each line holds a `SendModel` shaped object (the body of `POST /send/{provider}`).
+The file is streamed in windows, the records of a window are signed as one
+batch per sender, then rendered and sent with bounded concurrency while SMTP
+connections are reused per sender. Sent line numbers are
+appended to a checkpoint file, so an interrupted run resumes where it stopped.
+
+    python backend/send.py requests.jsonl --provider outlook --concurrency 4
+"""
+import argparse
+import json
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 import sys
+import time
 from dotenv import load_dotenv
-import base64
 
 path_root = Path(__file__).parents[1]
 sys.path.append(os.path.join(path_root))
 sys.path.append(os.path.join(path_root, 'backend'))
 
-from signer import Signer, SignatureType, SMTPConfig, UserConfig, EmailConfig
+from signer import Signer, SignatureType, SMTPConfig, UserConfig, EmailConfig, SMTP_PROVIDERS
+from smtp_pool import SMTPPool
+from signing import get_signing_service
+from log import setup_logging, stop_logging
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 PASSWORD = os.getenv('PASS')
-SELF_URL = os.getenv('SELF_URL')
 FRONTEND_URL = os.getenv('FRONTEND_URL')
 
-if not SELF_URL:
-    raise ValueError('SELF_URL not found in .env file')
+REQUIRED_FIELDS = ['name', 'role', 'email', 'latin_name', 'latin_role', 'subject', 'message_body']
+
+
+def convert_recipients(recipients):
+    if isinstance(recipients, str):
+        return [recipients]
+    elif isinstance(recipients, list):
+        return recipients
+    return None
+
+
+def read_checkpoint(checkpoint_path: str) -> set[int]:
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, 'r') as f:
+        return {int(line) for line in f if line.strip()}
+
+
+def iter_records(records_path: str, done: set[int]):
+    """
+    Yield (line_number, record, error) for every record that is not in the checkpoint.
+    Lines that are not a JSON object are yielded with the error instead of a record.
+    """
+    with open(records_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if line_number in done or not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, f"Record is not a JSON object: {type(record).__name__}"
+                continue
+            yield line_number, record, None
+
+
+class BatchSender:
+    def __init__(self, provider: str, verify_url: str, pool_size: int):
+        self.__smtp_config = SMTPConfig(SMTP_PROVIDERS[provider], 587)
+        self.__verify_url = verify_url
+        self.__smtp_pool = SMTPPool(max_connections=pool_size)
+        self.__signers = {}
+
+    def get_signer(self, record: dict) -> Signer:
+        # One signer per sender identity, so the private key is loaded once
+        user_config = UserConfig(
+            record['name'],
+            record['email'],
+            record.get('password') or PASSWORD,
+            record['role'],
+            record['latin_name'],
+            record['latin_role']
+        )
+        key = tuple(user_config.__dict__.values())
+        if key not in self.__signers:
+            self.__signers[key] = Signer(
+                user_config,
+                self.__smtp_config,
+                os.path.join('backend', 'email.html'),
+                self.__verify_url,
+                SignatureType.SIMPLE,
+                smtp_pool=self.__smtp_pool
+            )
+        return self.__signers[key]
+
+    @staticmethod
+    def build_email_config(record: dict) -> EmailConfig:
+        return EmailConfig(
+            record['subject'],
+            record['message_body'],
+            convert_recipients(record.get('recipients')),
+            convert_recipients(record.get('cc')),
+            convert_recipients(record.get('bcc')),
+            record.get('reply_to')
+        )
+
+    @staticmethod
+    def sign(prepared: list[tuple[int, Signer, EmailConfig]]) -> list[dict]:
+        """
+        Sign the prepared records with one `sign_many` batch per sender.
+        Returns the verifications in the order of `prepared`.
+        """
+        by_signer = {}
+        for index, (_, signer, _) in enumerate(prepared):
+            by_signer.setdefault(signer, []).append(index)
+
+        verifications = [None] * len(prepared)
+        for signer, indexes in by_signer.items():
+            for index, fields in zip(indexes, signer.inject_rsa_signatures(len(indexes))):
+                verifications[index] = fields
+        return verifications
+
+    @staticmethod
+    def send(signer: Signer, email_config: EmailConfig, verifications: dict) -> str | None:
+        try:
+            result = signer.send_email(email_config, verifications)
+        finally:
+            email_config.close()
+        return None if result.success else result.error
+
+    def prepare(self, record: dict):
+        missing = [field for field in REQUIRED_FIELDS if not record.get(field)]
+        if missing:
+            raise ValueError(f"Missing fields: {', '.join(missing)}")
+
+        email_config = self.build_email_config(record)
+        if not email_config.is_valid():
+            email_config.close()
+            raise ValueError("Invalid email configuration")
+        return self.get_signer(record), email_config
+
+    def close(self):
+        self.__smtp_pool.close()
+
+
+def iter_windows(items, size: int):
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def run(records_path: str, checkpoint_path: str, provider: str, concurrency: int, sign_batch: int) -> dict:
+    done = read_checkpoint(checkpoint_path)
+    summary = {"sent": 0, "failed": 0, "skipped": len(done)}
+    sender = BatchSender(provider, FRONTEND_URL, pool_size=concurrency)
+    started = time.perf_counter()
+    pending = {}
+
+    def record_failure(line_number: int, error: str):
+        summary["failed"] += 1
+        logger.warning("Line %s failed: %s", line_number, error, extra={"line": line_number})
+
+    def collect(finished, checkpoint):
+        for future in finished:
+            line_number = pending.pop(future)
+            if future.cancelled():
+                logger.info("Line %s was not sent", line_number, extra={"line": line_number})
+                continue
+            error = future.result()
+            if error:
+                record_failure(line_number, error)
+                continue
+            summary["sent"] += 1
+            checkpoint.write(f"{line_number}\n")
+            checkpoint.flush()
 
-print(f'Password: {PASSWORD}')
+    # At most two records per worker are rendered or queued at any time
+    max_pending = concurrency * 2
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    with open(checkpoint_path, 'a') as checkpoint:
+        try:
+            for window in iter_windows(iter_records(records_path, done), sign_batch):
+                prepared = []
+                for line_number, record, error in window:
+                    if error is None:
+                        try:
+                            prepared.append((line_number, *sender.prepare(record)))
+                            continue
+                        except (KeyError, ValueError) as e:
+                            error = str(e)
+                    record_failure(line_number, error)
 
+                for (line_number, signer, email_config), verifications in zip(prepared, sender.sign(prepared)):
+                    if len(pending) >= max_pending:
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(finished, checkpoint)
+                    pending[executor.submit(BatchSender.send, signer, email_config, verifications)] = line_number
 
-def convert_to_base64(message: str):
-    return f'base64:{base64.b64encode(message.encode()).decode("utf-8")}'
+            collect(wait(pending).done, checkpoint)
+        except BaseException:
+            # Interrupted: drop the queued sends, but checkpoint the ones that were
+            # already running, so a resumed run does not send them again
+            executor.shutdown(wait=False, cancel_futures=True)
+            # wait() never returns for futures cancelled this way, so they are dropped first
+            collect([future for future in pending if future.cancelled()], checkpoint)
+            collect(wait(pending).done, checkpoint)
+            raise
+        finally:
+            executor.shutdown()
+            sender.close()
 
+    elapsed = time.perf_counter() - started
+    processed = summary["sent"] + summary["failed"]
+    signing = get_signing_service()
+    summary["elapsed"] = round(elapsed, 3)
+    summary["messages_per_second"] = round(processed / elapsed, 2) if elapsed else None
+    summary["signing_batches"] = signing.batches
+    summary["signed_per_second"] = round(signing.signed / signing.batch_elapsed, 2) if signing.batch_elapsed else None
+    return summary
 
-user_config = UserConfig(
-    'ヘゲディス・ジョシュア',
-    'josh.hegedus@outlook.com',
-    PASSWORD,
-    '開発者',
-    'Joshua Hegedus',
-    'Developer',
-)
 
+def main():
+    parser = argparse.ArgumentParser(description="Sign and send a JSONL file of send records.")
+    parser.add_argument('records', help="JSONL file with one SendModel shaped object per line")
+    parser.add_argument('-p', '--provider', choices=list(SMTP_PROVIDERS), default='outlook')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help="Number of parallel sends")
+    parser.add_argument('-b', '--sign-batch', type=int, default=32, help="Records read and signed as one batch")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: <records>.checkpoint)")
+    args = parser.parse_args()
+    # stdout only carries the summary
+    setup_logging(stream=sys.stderr)
 
-email = EmailConfig(
-    "My subject",
-    convert_to_base64("My message"),
-    ["josh.hegedus@outlook.com"]
-)
+    if not FRONTEND_URL:
+        raise ValueError('FRONTEND_URL not found in .env file')
 
-signer = Signer(
-    user_config,
-    SMTPConfig(smtp_server='smtp.office365.com'),
-    os.path.join('backend', 'email.html'),
-    FRONTEND_URL,
-    SignatureType.SIMPLE
-)
+    checkpoint_path = args.checkpoint or f"{args.records}.checkpoint"
+    summary = run(args.records, checkpoint_path, args.provider, args.concurrency, args.sign_batch)
+    # The failures are logged before the summary
+    stop_logging()
+    print(json.dumps(summary))
+    if summary["failed"]:
+        sys.exit(1)
 
-signer.send_email(email)
 
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
+import binascii
+import codecs
+import logging
 import smtplib
 import urllib.parse
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from contextlib import contextmanager
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
 import pyperclip
 import re
 import datetime
@@ -19,14 +23,30 @@ sys.path.append(os.path.join(path_root))
 sys.path.append(os.path.join(path_root, 'backend'))
 
 from rsa import RSA
+from mime import EncodedSegment, MimePart, MultipartPart, StreamingMessage, send_streaming, \
+    normalize_content_type, CONTROL_CHARACTERS
+from signing import SigningService, get_signing_service
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 use_encryption = True
 ENV = os.getenv('ENV') or 'dev'
+MAX_MESSAGE_BODY_SIZE = int(os.getenv('MAX_MESSAGE_BODY_SIZE', 10 * 1024 * 1024))
+MAX_ATTACHMENT_SIZE = int(os.getenv('MAX_ATTACHMENT_SIZE', 20 * 1024 * 1024))
+MAX_ATTACHMENTS_TOTAL_SIZE = int(os.getenv('MAX_ATTACHMENTS_TOTAL_SIZE', 25 * 1024 * 1024))
+# Bodies larger than this are spooled to a temporary file instead of memory
+SPOOL_MAX_MEMORY = int(os.getenv('SPOOL_MAX_MEMORY', 1024 * 1024))
+# Characters `base64.b64decode` skips when it does not validate
+NON_BASE64_PATTERN = re.compile(r'[^A-Za-z0-9+/=]')
+# The content ID of an inline part, without the angle brackets
+CONTENT_ID_PATTERN = re.compile(r'[!-;=?-~]+')
+# Placeholder for the email body while the template is rendered, the body is
+# streamed in its place when the message is written
+BODY_PLACEHOLDER = '<!-- STREAMED_EMAIL_CONTENT -->'
 
 
 def convert_links_to_images(html_content):
-    print("Converting links to images...")
+    logger.debug("Converting links to images...")
     soup = BeautifulSoup(html_content, 'html.parser')
     links_to_convert = soup.find_all('a', class_='convert-to-image')
 
@@ -35,10 +55,10 @@ def convert_links_to_images(html_content):
         svg_tags = sub_soup.find_all('svg')
         for svg_tag in svg_tags:
             if 'id' not in svg_tag.attrs:
-                print("Invalid <svg> tag.")
+                logger.warning("Invalid <svg> tag.")
                 continue
             svg_id = svg_tag['id']
-            print(f"Converting {svg_id} to image...")
+            logger.debug("Converting %s to image...", svg_id)
 
             img_path = f'assets/{svg_id}-base64.txt'
 
@@ -46,7 +66,7 @@ def convert_links_to_images(html_content):
                 with open(img_path, 'r') as f:
                     base64_string = f.read()
             else:
-                print(f"No image found for {svg_id}. In {img_path}")
+                logger.warning("No image found for %s. In %s", svg_id, img_path)
                 continue
 
             img_tag = f'<img src="{base64_string}">'
@@ -56,7 +76,7 @@ def convert_links_to_images(html_content):
 
 
 def clean_up_html(html_content):
-    print("Cleaning up HTML content...")
+    logger.debug("Cleaning up HTML content...")
     remove_strings = [
         '<link rel="stylesheet" href="txt-styles.css">',
         '<meta charset="utf-8">',
@@ -67,6 +87,33 @@ def clean_up_html(html_content):
     return html_content
 
 
+def minify_css(css: str):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};,])\s*", r"\1", css).replace(": ", ":").strip()
+
+
+def minify_html(html_content: str):
+    """
+    Minify the static template HTML. Comments (except the body placeholder) are removed,
+    inline styles are minified and whitespace runs are collapsed to a single space,
+    which renders the same in HTML.
+    """
+    html_content = re.sub(
+        r"<!--(?!\[if).*?-->",
+        lambda match: match.group(0) if match.group(0) == BODY_PLACEHOLDER else "",
+        html_content,
+        flags=re.DOTALL
+    )
+    html_content = re.sub(
+        r"(<style[^>]*>)(.*?)(</style>)",
+        lambda match: match.group(1) + minify_css(match.group(2)) + match.group(3),
+        html_content,
+        flags=re.DOTALL
+    )
+    return re.sub(r"\s+", " ", html_content).strip()
+
+
 def create_fields(name: str, email: str, role: str, **kwargs):
     fields = {
         'main_name': name,
@@ -113,12 +160,10 @@ def substitute_css_colors(css_string: str):
     return css_string
 
 
-def combine_template_with_styles(template: str, styles: list):
+@lru_cache(maxsize=None)
+def load_styles(styles: tuple):
     """
-    Combine the email template with the styles.
-
-    :param template: The email template string.
-    :param styles: A list of style.css file paths.
+    Read and prepare the style sheets once, they do not change while the service runs.
     """
     styles_str = ""
     for style in styles:
@@ -126,25 +171,106 @@ def combine_template_with_styles(template: str, styles: list):
             styles_str += f"{f.read()}\n"
 
     styles_str = substitute_css_colors(styles_str)
-    styles_str = f"<style>\n{styles_str}\n</style>"
+    return f"<style>\n{styles_str}\n</style>"
+
+
+def combine_template_with_styles(template: str, styles: list):
+    """
+    Combine the email template with the styles.
+
+    :param template: The email template string.
+    :param styles: A list of style.css file paths.
+    """
     obj = {
-        'STYLES': styles_str
+        'STYLES': load_styles(tuple(styles))
     }
     return fill_template_str(template, **obj, start_tag='<!--', end_tag='-->')
 
 
+class CompiledTemplate:
+    """
+    A template split into static segments and `{{ field }}` names, before and after
+    the email body. The static segments keep their encoded form, so only the fields
+    are encoded for every message.
+    """
+    FIELD_PATTERN = re.compile(r"\{\{ (\w+) \}\}")
+
+    def __init__(self, template: str):
+        head, _, tail = template.partition(BODY_PLACEHOLDER)
+        self.head = self.__compile(head)
+        self.tail = self.__compile(tail)
+
+    @staticmethod
+    def __compile(template: str):
+        segments = []
+        for index, piece in enumerate(CompiledTemplate.FIELD_PATTERN.split(template)):
+            if index % 2:
+                segments.append(piece)
+            elif piece:
+                segments.append(EncodedSegment(piece))
+        return segments
+
+    @staticmethod
+    def __render(segments: list, fields: dict):
+        return [
+            segment if isinstance(segment, EncodedSegment) else fields.get(segment, f"{{{{ {segment} }}}}")
+            for segment in segments
+        ]
+
+    def render(self, fields: dict):
+        return self.__render(self.head, fields), self.__render(self.tail, fields)
+
+
+@lru_cache(maxsize=None)
+def load_simple_template(signature_file: str) -> CompiledTemplate:
+    """
+    The email template with the simple signature and styles, cleaned up, minified and compiled.
+    """
+    simple_template = os.path.join('backend', 'sig-simple.html')
+    with open(simple_template, 'r') as f:
+        simple_template_content = f.read()
+
+    email_structure = {
+        'EMAIL_CONTENT': BODY_PLACEHOLDER,
+        'SIGNATURE': simple_template_content
+    }
+
+    template = fill_template_file(signature_file, **email_structure, start_tag='<!--', end_tag='-->')
+    template = combine_template_with_styles(template, [os.path.join('backend', 'txt-styles.css')])
+    return CompiledTemplate(minify_html(clean_up_html(template)))
+
+
+SMTP_PROVIDERS = {
+    'gmail': 'smtp.gmail.com',
+    'outlook': 'smtp.office365.com',
+}
+
+
 class SMTPConfig:
     def __init__(self, smtp_server: str = 'smtp.gmail.com', smtp_port: int = 587):
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
 
     def get_smtp_server(self):
-        print("Connecting to SMTP server...")
+        logger.debug("Connecting to SMTP server...")
         server = smtplib.SMTP(self.smtp_server, self.smtp_port)
         server.starttls()
-        print("Connected to SMTP server successfully.")
+        logger.debug("Connected to SMTP server successfully.")
         return server
 
+    @contextmanager
+    def connection(self, email: str, password: str):
+        server = self.get_smtp_server()
+        try:
+            server.login(email, password)
+            yield server
+        finally:
+            # Close the connection to the SMTP server
+            try:
+                server.quit()
+            except smtplib.SMTPException:
+                server.close()
+
 
 class SignatureType(Enum):
     COMPLEX = 1
@@ -171,6 +297,102 @@ def atou(b64: str, has_prefix=True):
     return decoded_string
 
 
+class MessageTooLargeError(ValueError):
+    pass
+
+
+class InvalidMessageBodyError(ValueError):
+    pass
+
+
+class InvalidAttachmentError(ValueError):
+    pass
+
+
+def check_size(name: str, size: int, limit: int):
+    if size > limit:
+        raise MessageTooLargeError(f"{name} is too large ({size} bytes, the limit is {limit} bytes)")
+
+
+def atou_to_file(b64: str, has_prefix=True, chunk_size: int = 64 * 1024) -> SpooledTemporaryFile:
+    """
+    Streaming version of `atou`. The base64 text is decoded and unquoted chunk by chunk
+    into a spooled temporary file holding the UTF-8 encoded result.
+    The decoded size is checked against MAX_MESSAGE_BODY_SIZE before anything is decoded.
+    Raises InvalidMessageBodyError if the text is not base64 encoded UTF-8.
+    """
+    start = len("base64:") if has_prefix else 0
+    check_size("Message body", (len(b64) - start) * 3 // 4, MAX_MESSAGE_BODY_SIZE)
+
+    body_file = SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    # Validates the decoded bytes like `atou` does, a character may span two chunks
+    utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+    rest = ''
+    pending = b''
+    try:
+        for offset in range(start, len(b64), chunk_size):
+            # Like b64decode, skip line breaks and other characters outside the alphabet,
+            # and keep the characters that do not fill a 4 character group for the next round
+            chunk = rest + NON_BASE64_PATTERN.sub('', b64[offset:offset + chunk_size])
+            usable = len(chunk) - len(chunk) % 4
+            chunk, rest = chunk[:usable], chunk[usable:]
+            decoded = base64.b64decode(chunk)
+            utf8_decoder.decode(decoded)
+            decoded = pending + decoded
+            # Keep a percent escape that is split between two chunks for the next round
+            cut = decoded.find(b'%', len(decoded) - 2)
+            if cut == -1:
+                pending = b''
+            else:
+                decoded, pending = decoded[:cut], decoded[cut:]
+            body_file.write(urllib.parse.unquote_to_bytes(decoded))
+        if rest:
+            # Raises the padding error `atou` raises for a truncated text
+            base64.b64decode(rest)
+        utf8_decoder.decode(b'', final=True)
+    except (binascii.Error, UnicodeDecodeError) as e:
+        body_file.close()
+        raise InvalidMessageBodyError(f"Message body is not valid base64 encoded UTF-8: {e}") from e
+    body_file.write(urllib.parse.unquote_to_bytes(pending))
+    body_file.seek(0)
+    return body_file
+
+
+def text_to_file(text: str) -> SpooledTemporaryFile:
+    encoded = text.encode('utf-8')
+    check_size("Message body", len(encoded), MAX_MESSAGE_BODY_SIZE)
+    body_file = SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    body_file.write(encoded)
+    body_file.seek(0)
+    return body_file
+
+
+def file_size(file) -> int:
+    position = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
+
+
+class Attachment:
+    """
+    A file sent with the message. An attachment with a content ID is an inline part
+    of the HTML body, which refers to it with `cid:<content_id>`.
+    """
+
+    def __init__(self, filename: str, content_type: str, file, content_id: str = None):
+        # The filename is written into the part headers
+        if filename and CONTROL_CHARACTERS.search(filename):
+            raise InvalidAttachmentError(f"Invalid attachment filename: {filename!r}")
+        self.filename = filename
+        self.content_type = normalize_content_type(content_type)
+        self.file = file
+        self.size = file_size(file)
+        # A content ID that can not be written as a header makes it a regular attachment
+        self.content_id = content_id if content_id and CONTENT_ID_PATTERN.fullmatch(content_id) else None
+
+
 class EmailConfig:
     def __init__(
             self,
@@ -180,16 +402,46 @@ class EmailConfig:
             cc: list[str] = None,
             bcc: list[str] = None,
             reply_to: str = None,
+            decode_body: bool = True,
+            attachments: list[Attachment] = None,
+            envelope_recipients: list[str] = None,
     ):
         self.subject = subject
         self.recipients = recipients
         self.cc = cc
         self.bcc = bcc
         self.reply_to = reply_to
-        self.message_body = atou(message_body, is_message_body_base64(message_body))
+        self.attachments = attachments or []
+        # The SMTP envelope, when it is given instead of being built from the headers
+        self.envelope_recipients = envelope_recipients
+
+        total_size = 0
+        for attachment in self.attachments:
+            check_size(f"Attachment {attachment.filename}", attachment.size, MAX_ATTACHMENT_SIZE)
+            total_size += attachment.size
+        check_size("Attachments", total_size, MAX_ATTACHMENTS_TOTAL_SIZE)
+
+        if not message_body:
+            self.body_file = text_to_file('')
+        elif decode_body:
+            self.body_file = atou_to_file(message_body, is_message_body_base64(message_body))
+        else:
+            self.body_file = text_to_file(message_body)
+        self.body_size = file_size(self.body_file)
+
+    @property
+    def message_body(self) -> str:
+        """
+        The whole decoded body. Reads the spooled body into memory, the send path streams it instead.
+        """
+        self.body_file.seek(0)
+        return self.body_file.read().decode('utf-8', errors='replace')
+
+    def close(self):
+        self.body_file.close()
 
     def is_valid(self):
-        return self.subject and self.message_body and (self.recipients or self.cc or self.bcc)
+        return self.subject and self.body_size and self.combine_recipients()
 
     def get_recipients_string(self):
         return ','.join(self.recipients) if self.recipients else None
@@ -201,6 +453,8 @@ class EmailConfig:
         return ','.join(self.bcc) if self.bcc else None
 
     def combine_recipients(self):
+        if self.envelope_recipients is not None:
+            return list(self.envelope_recipients)
         all_recipients = []
         if self.recipients:
             all_recipients += self.recipients
@@ -230,12 +484,23 @@ class UserConfig:
 
 
 class Signature:
-    def __init__(self, content: str, signed_content: str, rsa_signature: str, email: str):
-        self.content = content
+    def __init__(self, head: list, tail: list, signed_content: str, rsa_signature: str, email: str):
+        # The rendered template around the streamed email body, as str and EncodedSegment pieces
+        self.head = head
+        self.tail = tail
         self.signed_content = signed_content
         self.rsa_signature = rsa_signature
         self.email = email
 
+    @classmethod
+    def from_content(cls, content: str, signed_content: str, rsa_signature: str, email: str):
+        head, _, tail = clean_up_html(content).partition(BODY_PLACEHOLDER)
+        return cls([head], [tail], signed_content, rsa_signature, email)
+
+    def render(self, body: str) -> str:
+        pieces = self.head + [body] + self.tail
+        return ''.join(piece.text if isinstance(piece, EncodedSegment) else piece for piece in pieces)
+
 
 class Signer:
     def __init__(
@@ -245,31 +510,44 @@ class Signer:
             signature_file: str,
             verify_url: str,
             signature_type: SignatureType = SignatureType.SIMPLE,
+            smtp_pool=None,
+            signing_service: SigningService = None,
     ):
         self.__smtp_config = smtp_config
+        self.__smtp_pool = smtp_pool
         self.__signature_file = signature_file
         self.__signature_type = signature_type
         self.__user = user
-        self.__rsa = RSA(user.email)
+        self.__signing_service = signing_service or get_signing_service()
+        # Load (or generate) the key up front, so it is shared by every signing worker
+        self.__signing_service.get_key(user.email)
         self.__verify_url = verify_url
 
+    def __create_sig_message(self, funny_quote: str = ""):
+        mail_id = str(uuid4())
+        end = f'-{funny_quote}' if funny_quote else ''
+        formatted_date_ja = datetime.datetime.now().strftime('%Y年%m月%d日-%H:%M:%S')
+        data = obfuscate_email_in_str(f"{str(mail_id)}-{formatted_date_ja}{end}", self.__user.email)
+        return mail_id, data
+
+    @staticmethod
+    def __verified_fields(mail_id: str, data: str, signature: str):
+        return {
+            'verified_title': signature,
+            'verified_href': mail_id,
+            'verified': '.verified',
+            'sig_message': data,
+        }
+
     def inject_rsa_signature(self, funny_quote: str = ""):
         """
         Returns the encrypted contents of the email and the formatting object.
         """
 
         if use_encryption:
-            mail_id = str(uuid4())
-            end = f'-{funny_quote}' if funny_quote else ''
-            formatted_date_ja = datetime.datetime.now().strftime('%Y年%m月%d日-%H:%M:%S')
-            data = obfuscate_email_in_str(f"{str(mail_id)}-{formatted_date_ja}{end}", self.__user.email)
-            signature = self.__rsa.create_signed_message(data)
-            return {
-                'verified_title': signature,
-                'verified_href': mail_id,
-                'verified': '.verified',
-                'sig_message': data,
-            }
+            mail_id, data = self.__create_sig_message(funny_quote)
+            signature = self.__signing_service.sign(self.__user.email, data)
+            return self.__verified_fields(mail_id, data, signature)
         else:
             return {
                 'verified_title': '',
@@ -277,8 +555,22 @@ class Signer:
                 'verified': '.not-verified',
             }
 
-    def __generate_complex_signature(self, body: str) -> Signature:
-        verifications = self.inject_rsa_signature()
+    def inject_rsa_signatures(self, count: int, funny_quote: str = ""):
+        """
+        Same as `inject_rsa_signature` for `count` emails at once, signed as one batch.
+        """
+        if not use_encryption:
+            return [self.inject_rsa_signature(funny_quote) for _ in range(count)]
+
+        messages = [self.__create_sig_message(funny_quote) for _ in range(count)]
+        result = self.__signing_service.sign_many(self.__user.email, [data for _, data in messages])
+        return [
+            self.__verified_fields(mail_id, data, signature)
+            for (mail_id, data), signature in zip(messages, result.signatures)
+        ]
+
+    def __generate_complex_signature(self, body: str, verifications: dict = None) -> Signature:
+        verifications = verifications or self.inject_rsa_signature()
 
         obj = {
             'EMAIL_CONTENT': body,
@@ -290,20 +582,12 @@ class Signer:
         template = convert_links_to_images(template)
         template = combine_template_with_styles(template, [os.path.join('backend', 'styles.css')])
 
-        return Signature(template, verifications['data'], verifications['verified_title'], self.__user.email)
+        return Signature.from_content(template, verifications['data'], verifications['verified_title'],
+                                      self.__user.email)
 
-    def __generate_simple_signature(self, body: str, subject: str) -> Signature:
-        verifications = self.inject_rsa_signature()
-        simple_template = os.path.join('backend', 'sig-simple.html')
-        with open(simple_template, 'r') as f:
-            simple_template_content = f.read()
-
-        email_structure = {
-            'EMAIL_CONTENT': body,
-            'SIGNATURE': simple_template_content
-        }
-
-        template = fill_template_file(self.__signature_file, **email_structure, start_tag='<!--', end_tag='-->')
+    def __generate_simple_signature(self, subject: str, verifications: dict = None) -> Signature:
+        verifications = verifications or self.inject_rsa_signature()
+        template = load_simple_template(self.__signature_file)
 
         misc_fields = {
             "latin_name": self.__user.latin_name,
@@ -316,72 +600,76 @@ class Signer:
         all_fields = create_fields(self.__user.name, self.__user.email, self.__user.role)
         all_fields.update(verifications)
         all_fields.update(misc_fields)
-        text_signature = fill_template_str(template, **all_fields)
-        text_signature = combine_template_with_styles(text_signature, [os.path.join('backend', 'txt-styles.css')])
+        head, tail = template.render(all_fields)
 
-        return Signature(text_signature, verifications['sig_message'], verifications['verified_title'],
+        return Signature(head, tail, verifications['sig_message'], verifications['verified_title'],
                          self.__user.email)
 
-    def send_email(self, email: EmailConfig) -> SignerResponse:
+    def send_email(self, email: EmailConfig, verifications: dict = None) -> SignerResponse:
+        """
+        Sign and send the email. `verifications` can be one of the results of
+        `inject_rsa_signatures` when the signatures were created in a batch.
+        """
+        # The body is not rendered into the template, it is streamed between head and tail
         if self.__signature_type == SignatureType.COMPLEX:
-            signature = self.__generate_complex_signature(email.message_body)
+            signature = self.__generate_complex_signature(BODY_PLACEHOLDER, verifications)
         else:
-            signature = self.__generate_simple_signature(email.message_body, email.subject)
+            signature = self.__generate_simple_signature(email.subject, verifications)
 
-        html_content = clean_up_html(signature.content)
         if ENV == 'dev':
-            pyperclip.copy(html_content)
+            pyperclip.copy(signature.render(email.message_body))
             # Test back the verification
-            print(f"Verification: {signature.signed_content}")
+            logger.info("Verification: %s", signature.signed_content)
             rsa = RSA(signature.email)
-            print(f"Verification result: {rsa.verify(signature.rsa_signature, signature.signed_content)}")
-            print("Stopping execution because the environment is dev.")
+            logger.info("Verification result: %s", rsa.verify(signature.rsa_signature, signature.signed_content))
+            logger.info("Stopping execution because the environment is dev.")
             return SignerResponse(True, "Email sent successfully!", "")
 
         try:
-            server = self.__smtp_config.get_smtp_server()
-        except Exception as e:
-            print(f"Failed to connect to SMTP server. Error: {str(e)}")
-            return SignerResponse(False, None, str(e))
-
-        try:
-            server.login(self.__user.email, self.__user.password)
-            msg = MIMEMultipart('alternative')
-            msg['From'] = self.__user.email
-            msg['Subject'] = email.subject
-
-            if email.recipients:
-                msg['To'] = email.get_recipients_string()
-            else:
-                msg['To'] = ""
-
-            if email.cc:
-                msg['Cc'] = email.get_cc_string()
-            else:
-                msg['Cc'] = ""
-
-            if email.bcc:
-                msg['Bcc'] = email.get_bcc_string()
-            else:
-                msg['Bcc'] = ""
-
-            if email.reply_to:
-                msg.add_header('In-Reply-To', email.reply_to)
-                msg.add_header('References', email.reply_to)
-
-            msg.attach(MIMEText(html_content, 'html'))
-            print("Sending email...")
+            msg = self.build_message(email, signature)
             recipients = email.combine_recipients()
-            if ENV == 'test' or ENV == 'prod':
-                server.sendmail(self.__user.email, recipients, msg.as_string())
-            else:
-                print(f"Recipients: {recipients}")
-                print("Email not sent because the environment is not prod or test.")
-            print("Email sent successfully!")
+            with self.__smtp_connection() as server:
+                logger.debug("Sending email...")
+                if ENV == 'test' or ENV == 'prod':
+                    send_streaming(server, self.__user.email, recipients, msg)
+                else:
+                    logger.info("Recipients: %s", recipients)
+                    logger.info("Email not sent because the environment is not prod or test.")
+            logger.info("Email sent successfully!", extra={"sender": self.__user.email, "recipients": len(recipients)})
             return SignerResponse(True, "Email sent successfully!", "")
         except Exception as e:
-            print(f"Failed to send email. Error: {str(e)}")
+            logger.error("Failed to send email. Error: %s", e, extra={"sender": self.__user.email})
             return SignerResponse(False, None, str(e))
-        finally:
-            # Close the connection to the SMTP server
-            server.quit()
+
+    def __smtp_connection(self):
+        if self.__smtp_pool is not None:
+            return self.__smtp_pool.connection(self.__smtp_config, self.__user.email, self.__user.password)
+        return self.__smtp_config.connection(self.__user.email, self.__user.password)
+
+    def build_message(self, email: EmailConfig, signature: Signature) -> StreamingMessage:
+        headers = [
+            ('From', self.__user.email),
+            ('Subject', email.subject),
+            ('To', email.get_recipients_string() or ""),
+            ('Cc', email.get_cc_string() or ""),
+        ]
+        # Bcc recipients are only in the envelope, a Bcc header would show them to everyone
+
+        if email.reply_to:
+            headers.append(('In-Reply-To', email.reply_to))
+            headers.append(('References', email.reply_to))
+
+        html = MimePart('text/html', signature.head + [email.body_file] + signature.tail, charset='utf-8')
+        parts = [
+            MimePart(attachment.content_type, [attachment.file], filename=attachment.filename,
+                     content_id=attachment.content_id)
+            for attachment in email.attachments
+        ]
+        inline = [part for part in parts if part.content_id]
+        attachments = [part for part in parts if not part.content_id]
+
+        # Inline parts are kept next to the HTML that refers to them
+        if inline and not attachments:
+            return StreamingMessage('related', headers, [html] + inline)
+        body = MultipartPart('related', [html] + inline) if inline else html
+        return StreamingMessage('mixed' if attachments else 'alternative', headers, [body] + attachments)
@@ -0,0 +1,146 @@
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root))
+sys.path.append(os.path.join(path_root, 'backend'))
+
+from rsa import RSA
+from log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# 'thread' shares the loaded keys with the API, 'process' signs on every core
+SIGNING_POOL = os.getenv('SIGNING_POOL', 'thread')
+SIGNING_WORKERS = int(os.getenv('SIGNING_WORKERS', os.cpu_count() or 1))
+
+# Keys loaded by a worker process, one per sender
+_process_keys = {}
+
+
+def _init_worker():
+    # A worker process does not share the log queue of the service, it writes its own
+    # records, to stderr so they never mix with the output of a command line tool
+    setup_logging(stream=sys.stderr)
+
+
+def _sign_in_process(email: str, payloads: list[str]) -> list[str]:
+    version = RSA.get_key_version(email)
+    if email not in _process_keys or _process_keys[email][0] != version:
+        _process_keys[email] = (version, RSA(email))
+    rsa = _process_keys[email][1]
+    return [rsa.create_signed_message(payload) for payload in payloads]
+
+
+def _split(items: list, parts: int) -> list[list]:
+    size = -(-len(items) // parts)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class SigningBatchResult:
+    def __init__(self, signatures: list[str], elapsed: float):
+        self.signatures = signatures
+        self.elapsed = elapsed
+        self.per_second = len(signatures) / elapsed if elapsed else None
+
+
+class SigningService:
+    """
+    Signs payloads on a dedicated thread or process pool instead of the caller's thread.
+    """
+
+    def __init__(self, pool: str = SIGNING_POOL, workers: int = SIGNING_WORKERS):
+        if pool not in ('thread', 'process'):
+            raise ValueError(f'Invalid signing pool: {pool}')
+        self.pool = pool
+        self.workers = workers
+        if pool == 'process':
+            # Spawned, since forking the threaded service can deadlock on locks held by other threads
+            self.__executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+        else:
+            self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='signer')
+        self.__keys = {}
+        self.__lock = threading.Lock()
+        # Statistics of the sign_many batches
+        self.signed = 0
+        self.batches = 0
+        self.batch_elapsed = 0.0
+        self.last_batch_per_second = None
+
+    def get_key(self, email: str) -> RSA:
+        # Loading under the lock also makes sure a new key is generated only once,
+        # before any worker process tries to load it from the key file.
+        # A rotated key file has a new version and is reloaded.
+        version = RSA.get_key_version(email)
+        with self.__lock:
+            if email not in self.__keys or self.__keys[email][0] != version:
+                rsa = RSA(email)
+                self.__keys[email] = (RSA.get_key_version(email), rsa)
+            return self.__keys[email][1]
+
+    def __record(self, result: SigningBatchResult):
+        with self.__lock:
+            self.signed += len(result.signatures)
+            self.batches += 1
+            self.batch_elapsed += result.elapsed
+            self.last_batch_per_second = result.per_second
+
+    def sign(self, email: str, payload: str) -> str:
+        rsa = self.get_key(email)
+        if self.pool == 'process':
+            signature = self.__executor.submit(_sign_in_process, email, [payload]).result()[0]
+        else:
+            signature = self.__executor.submit(rsa.create_signed_message, payload).result()
+        return signature
+
+    def sign_many(self, email: str, payloads: list[str]) -> SigningBatchResult:
+        """
+        Sign a batch of payloads with the key of `email` in parallel.
+        The signatures are returned in the order of the payloads.
+        """
+        started = time.perf_counter()
+        rsa = self.get_key(email)
+        if not payloads:
+            return SigningBatchResult([], 0.0)
+
+        if self.pool == 'process':
+            futures = [
+                self.__executor.submit(_sign_in_process, email, chunk)
+                for chunk in _split(payloads, self.workers)
+            ]
+            signatures = [signature for future in futures for signature in future.result()]
+        else:
+            signatures = list(self.__executor.map(rsa.create_signed_message, payloads))
+
+        result = SigningBatchResult(signatures, time.perf_counter() - started)
+        self.__record(result)
+        logger.info("Signed %s payloads for %s", len(signatures), email, extra={
+            "signatures": len(signatures),
+            "per_second": result.per_second,
+        })
+        return result
+
+    def shutdown(self):
+        self.__executor.shutdown()
+
+
+_signing_service = None
+_signing_service_lock = threading.Lock()
+
+
+def get_signing_service() -> SigningService:
+    global _signing_service
+    with _signing_service_lock:
+        if _signing_service is None:
+            _signing_service = SigningService()
+        return _signing_service
@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 16))
+SMTP_POOL_IDLE_TIMEOUT = float(os.getenv('SMTP_POOL_IDLE_TIMEOUT', 60))
+
+
+class SMTPPool:
+    """
+    Keeps logged in SMTP connections per (server, port, email) so consecutive
+    sends of the same sender skip the connect, STARTTLS and login round trips.
+    """
+
+    def __init__(self, max_connections: int = 16, idle_timeout: float = 60.0):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.in_use = 0
+        self.__idle = {}
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(max_connections)
+
+    def __take_idle(self, key):
+        expired = []
+        server = None
+        with self.__lock:
+            connections = self.__idle.get(key, [])
+            while connections:
+                candidate, last_used = connections.pop()
+                if time.monotonic() - last_used < self.idle_timeout:
+                    server = candidate
+                    break
+                expired.append(candidate)
+
+        for connection in expired:
+            self.__close(connection)
+        return server
+
+    def __put_idle(self, key, server):
+        with self.__lock:
+            self.__idle.setdefault(key, []).append((server, time.monotonic()))
+
+    def __total_idle(self):
+        with self.__lock:
+            return sum(len(connections) for connections in self.__idle.values())
+
+    def __evict_one(self):
+        # Make room for a connection of another sender by dropping the oldest idle one
+        with self.__lock:
+            oldest_key, oldest_index, oldest_time = None, None, None
+            for key, connections in self.__idle.items():
+                for index, (_, last_used) in enumerate(connections):
+                    if oldest_time is None or last_used < oldest_time:
+                        oldest_key, oldest_index, oldest_time = key, index, last_used
+            if oldest_key is None:
+                return
+            server, _ = self.__idle[oldest_key].pop(oldest_index)
+        self.__close(server)
+
+    @staticmethod
+    def __close(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    def __is_alive(server) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    @contextmanager
+    def connection(self, smtp_config, email: str, password: str):
+        key = (smtp_config.smtp_server, smtp_config.smtp_port, email, password)
+        self.__slots.acquire()
+        with self.__lock:
+            self.in_use += 1
+        try:
+            server = self.__take_idle(key)
+            if server is not None and not self.__is_alive(server):
+                self.__close(server)
+                server = None
+
+            if server is None:
+                if self.__total_idle() + self.in_use > self.max_connections:
+                    self.__evict_one()
+                server = smtp_config.get_smtp_server()
+                try:
+                    server.login(email, password)
+                except Exception:
+                    self.__close(server)
+                    raise
+
+            try:
+                yield server
+            except Exception:
+                # The session state is unknown after a failure, do not reuse it
+                self.__close(server)
+                raise
+            self.__put_idle(key, server)
+        finally:
+            with self.__lock:
+                self.in_use -= 1
+            self.__slots.release()
+
+    def stats(self) -> dict:
+        with self.__lock:
+            in_use = self.in_use
+            idle = sum(len(connections) for connections in self.__idle.values())
+        return {
+            "in_use": in_use,
+            "idle": idle,
+            "max_connections": self.max_connections,
+            "usage": in_use / self.max_connections,
+        }
+
+    def close(self):
+        with self.__lock:
+            connections = [server for servers in self.__idle.values() for server, _ in servers]
+            self.__idle.clear()
+        for server in connections:
+            self.__close(server)
+
+
+_smtp_pool = None
+_smtp_pool_lock = threading.Lock()
+
+
+def get_smtp_pool() -> SMTPPool:
+    global _smtp_pool
+    with _smtp_pool_lock:
+        if _smtp_pool is None:
+            _smtp_pool = SMTPPool(SMTP_POOL_SIZE, SMTP_POOL_IDLE_TIMEOUT)
+        return _smtp_pool
@@ -0,0 +1,241 @@
+import asyncio
+import contextvars
+import logging
+import mimetypes
+import os
+import sys
+import threading
+from email import policy
+from email.parser import BytesParser
+from email.utils import getaddresses
+from functools import partial
+from html import escape
+from io import BytesIO
+from uuid import uuid4
+from pathlib import Path
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult, LoginPassword
+from dotenv import load_dotenv
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root))
+
+from backend.signer import Signer, SignatureType, SMTPConfig, UserConfig, EmailConfig, SMTP_PROVIDERS, \
+    MessageTooLargeError, InvalidAttachmentError, Attachment
+from backend.smtp_pool import get_smtp_pool
+from backend.metrics import send_metrics
+from backend.log import request_id, setup_logging
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SMTP_RELAY_HOST = os.getenv('SMTP_RELAY_HOST', '127.0.0.1')
+SMTP_RELAY_PORT = os.getenv('SMTP_RELAY_PORT')
+SMTP_RELAY_PROVIDER = os.getenv('SMTP_RELAY_PROVIDER', 'outlook')
+FRONTEND_URL = os.getenv('FRONTEND_URL')
+
+# Headers the local client uses to pass the signature fields. They are
+# consumed by the relay and never forwarded upstream.
+SIGNATURE_HEADERS = {
+    'name': 'X-Signature-Name',
+    'role': 'X-Signature-Role',
+    'latin_name': 'X-Signature-Latin-Name',
+    'latin_role': 'X-Signature-Latin-Role',
+}
+
+
+def authenticate(server, session, envelope, mechanism, auth_data):
+    """
+    Accept the upstream credentials for LOGIN/PLAIN. They are validated when
+    the relay logs in to the provider, so a wrong password fails the DATA step.
+    """
+    if not isinstance(auth_data, LoginPassword):
+        return AuthResult(success=False, handled=False)
+    return AuthResult(success=True, auth_data=auth_data)
+
+
+def extract_html_body(message) -> str | None:
+    """
+    Return the HTML part of the message. A plain text only message is escaped
+    and wrapped so it can be placed in the signature template.
+    """
+    part = message.get_body(preferencelist=('html', 'plain'))
+    if part is None:
+        return None
+
+    content = part.get_content()
+    if part.get_content_subtype() == 'html':
+        return content
+    return f"<p>{escape(content).replace(chr(10), '<br>')}</p>"
+
+
+def iter_attachment_parts(message):
+    """
+    Yield every leaf part that is not the body or one of its alternatives: attachments,
+    and the inline parts of a multipart/related body.
+    """
+    attachments = list(message.iter_attachments())
+    for part in attachments:
+        if part.get_content_maintype() == 'multipart':
+            yield from (leaf for leaf in part.walk() if leaf.get_content_maintype() != 'multipart')
+        else:
+            yield part
+
+    # The body containers can hold attachments of their own
+    for part in message.iter_parts():
+        if part.get_content_maintype() == 'multipart' and not any(part is attachment for attachment in attachments):
+            yield from iter_attachment_parts(part)
+
+
+def extract_attachments(message) -> list[Attachment]:
+    attachments = []
+    for index, part in enumerate(iter_attachment_parts(message), 1):
+        content_type = part.get_content_type()
+        content = part.get_payload(decode=True)
+        if content is None:
+            # message/rfc822 parts hold the attached message as an object
+            content = b''.join(payload.as_bytes() for payload in part.get_payload())
+        filename = part.get_filename() or f"attachment-{index}{mimetypes.guess_extension(content_type) or ''}"
+        # Parts the HTML refers to with cid: stay inline
+        content_id = part.get('Content-ID')
+        if content_id and part.get_content_disposition() != 'attachment':
+            content_id = content_id.strip().strip('<>')
+        else:
+            content_id = None
+        attachments.append(Attachment(filename, content_type, BytesIO(content), content_id))
+    return attachments
+
+
+def extract_addresses(message, header: str) -> list[str]:
+    return [address for _, address in getaddresses(message.get_all(header, [])) if address]
+
+
+class SigningRelayHandler:
+    def __init__(self, provider: str = SMTP_RELAY_PROVIDER, verify_url: str = FRONTEND_URL):
+        if provider not in SMTP_PROVIDERS:
+            raise ValueError(f'Invalid SMTP relay provider: {provider}')
+        self.__smtp_config = SMTPConfig(SMTP_PROVIDERS[provider], 587)
+        self.__verify_url = verify_url
+        self.__signers = {}
+        self.__signers_lock = threading.Lock()
+
+    def __get_signer(self, user_config: UserConfig) -> Signer:
+        # The signer loads the private key, so keep one per sender identity
+        key = (
+            user_config.email,
+            user_config.password,
+            user_config.name,
+            user_config.role,
+            user_config.latin_name,
+            user_config.latin_role,
+        )
+        # Sessions are relayed on executor threads, the lock keeps it one signer per identity
+        with self.__signers_lock:
+            if key not in self.__signers:
+                self.__signers[key] = Signer(
+                    user_config,
+                    self.__smtp_config,
+                    os.path.join('backend', 'email.html'),
+                    self.__verify_url,
+                    SignatureType.SIMPLE,
+                    smtp_pool=get_smtp_pool()
+                )
+            return self.__signers[key]
+
+    def build_email_config(self, message, rcpt_tos: list[str]) -> EmailConfig:
+        # The headers are shown as they are, the message goes to the envelope
+        # recipients only, like any other relay does
+        return EmailConfig(
+            message.get('Subject', ''),
+            extract_html_body(message),
+            extract_addresses(message, 'To') or None,
+            extract_addresses(message, 'Cc') or None,
+            None,
+            message.get('In-Reply-To'),
+            decode_body=False,
+            attachments=extract_attachments(message),
+            envelope_recipients=rcpt_tos
+        )
+
+    async def handle_DATA(self, server, session, envelope):
+        request_id.set(uuid4().hex)
+        credentials = session.auth_data
+        if not isinstance(credentials, LoginPassword):
+            return '530 5.7.0 Authentication required'
+
+        # Parsing, loading the key and sending block, so they run in the executor and
+        # the event loop keeps serving the other sessions. The request ID is kept there.
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, partial(context.run, self.relay, credentials, envelope))
+
+    def relay(self, credentials: LoginPassword, envelope) -> str:
+        """
+        Sign and send a received message. Returns the SMTP reply for the client.
+        """
+        message = BytesParser(policy=policy.default).parsebytes(envelope.original_content or envelope.content)
+        missing = [header for header in SIGNATURE_HEADERS.values() if not message.get(header)]
+        if missing:
+            return f"550 5.6.0 Missing signature headers: {', '.join(missing)}"
+
+        user_config = UserConfig(
+            message[SIGNATURE_HEADERS['name']],
+            credentials.login.decode(),
+            credentials.password.decode(),
+            message[SIGNATURE_HEADERS['role']],
+            message[SIGNATURE_HEADERS['latin_name']],
+            message[SIGNATURE_HEADERS['latin_role']]
+        )
+        try:
+            email_config = self.build_email_config(message, envelope.rcpt_tos)
+        except MessageTooLargeError as e:
+            return f'552 5.3.4 {e}'
+        except InvalidAttachmentError as e:
+            return f'550 5.6.0 {e}'
+
+        try:
+            if not email_config.is_valid():
+                logger.warning("Invalid relayed email: %s", email_config)
+                return '550 5.6.0 Message needs a subject, an HTML or text body and recipients'
+
+            signer = self.__get_signer(user_config)
+            with send_metrics.track():
+                result = signer.send_email(email_config)
+            if result.success:
+                return '250 2.0.0 Message signed and relayed'
+
+            return f'451 4.3.0 Relay failed: {result.error}'
+        finally:
+            email_config.close()
+
+
+def start_smtp_relay(host: str = SMTP_RELAY_HOST, port: int | str = SMTP_RELAY_PORT) -> Controller:
+    """
+    Start the SMTP listener in a background thread. Clients authenticate with
+    their upstream credentials, the HTML part is wrapped in the signature
+    template, signed and relayed through the configured provider together
+    with the attachments of the message.
+    """
+    controller = Controller(
+        SigningRelayHandler(),
+        hostname=host,
+        port=int(port),
+        authenticator=authenticate,
+        auth_required=True,
+        auth_require_tls=False,
+    )
+    controller.start()
+    logger.info("SMTP relay listening on %s:%s", host, port)
+    return controller
+
+
+if __name__ == "__main__":
+    if not SMTP_RELAY_PORT:
+        raise ValueError('SMTP_RELAY_PORT not found in .env file')
+    setup_logging()
+    relay = start_smtp_relay()
+    try:
+        asyncio.run(asyncio.Event().wait())
+    except KeyboardInterrupt:
+        relay.stop()
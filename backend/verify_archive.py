@@ -0,0 +1,259 @@
+"""
+Verify the signatures of archived emails offline.
+
+Streams through .eml files, mbox files and Maildir trees, extracts the signed
+message and signature from the verify links of the signature template and
+writes one JSON line per found signature.
+
+    python backend/verify_archive.py archive.mbox Maildir/ mails/*.eml -o report.jsonl
+"""
+import argparse
+import json
+import mailbox
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from email import policy
+from email.parser import BytesParser
+from pathlib import Path
+from urllib.parse import urlsplit, unquote
+
+from bs4 import BeautifulSoup
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root))
+
+from backend.rsa import public_key_index, split_signature, verify_with_public_key
+
+VERIFY_PATH = '/email/verify'
+
+
+def is_maildir(path: str) -> bool:
+    return all(os.path.isdir(os.path.join(path, sub)) for sub in ('cur', 'new', 'tmp'))
+
+
+def is_mbox(path: str) -> bool:
+    """
+    An mbox file has the .mbox extension or starts with a "From " line.
+    """
+    if path.endswith('.mbox'):
+        return True
+    try:
+        with open(path, 'rb') as f:
+            return f.read(5) == b'From '
+    except OSError:
+        return False
+
+
+def iter_maildir_files(path: str):
+    """
+    The messages of a Maildir, including its Maildir++ subfolders (.Sent, .Archive, ...).
+    """
+    for sub in ('cur', 'new'):
+        folder = os.path.join(path, sub)
+        for name in sorted(os.listdir(folder)):
+            yield os.path.join(folder, name)
+
+    for name in sorted(os.listdir(path)):
+        folder = os.path.join(path, name)
+        if name.startswith('.') and is_maildir(folder):
+            yield from iter_maildir_files(folder)
+
+
+def iter_mbox(path: str):
+    mbox = mailbox.mbox(path, create=False)
+    try:
+        for key in mbox.iterkeys():
+            yield f"{path}#{key}", mbox.get_bytes(key)
+    finally:
+        mbox.close()
+
+
+def iter_sources(paths: list[str]):
+    """
+    Yield (source, raw) pairs. Files are yielded by path and read by the worker,
+    mbox messages are read here one at a time since they share a single file.
+    A path that does not exist is yielded as a file too, the worker reports it as an error.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            if is_maildir(path):
+                yield from ((file_path, None) for file_path in iter_maildir_files(path))
+                continue
+
+            for root, dirs, files in os.walk(path):
+                for name in [d for d in dirs if is_maildir(os.path.join(root, d))]:
+                    dirs.remove(name)
+                    for file_path in iter_maildir_files(os.path.join(root, name)):
+                        yield file_path, None
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    if name.endswith('.eml'):
+                        yield file_path, None
+                    elif is_mbox(file_path):
+                        yield from iter_mbox(file_path)
+        elif os.path.isfile(path) and is_mbox(path):
+            yield from iter_mbox(path)
+        else:
+            # An .eml file or another single message
+            yield path, None
+
+
+def parse_verify_link(href: str) -> dict | None:
+    """
+    Split a verify link into its parameters. The template does not URL-encode the
+    values, so the query is split by hand instead of with parse_qs.
+    """
+    parts = urlsplit(href)
+    if not parts.path.endswith(VERIFY_PATH):
+        return None
+
+    params = {}
+    for pair in parts.query.split('&'):
+        key, _, value = pair.partition('=')
+        params[key] = unquote(value)
+
+    if not all(params.get(key) for key in ('email', 'message', 'signature')):
+        return None
+
+    # The obfuscated email in the signed message is unescaped by the HTML parser
+    params['message'] = params['message'].replace('\xad', '&#173;')
+    return params
+
+
+def extract_signatures(html: str) -> list[dict]:
+    soup = BeautifulSoup(html, 'html.parser')
+    signatures = []
+    for link in soup.find_all('a', href=True):
+        params = parse_verify_link(link['href'])
+        if params and params not in signatures:
+            signatures.append(params)
+    return signatures
+
+
+def get_public_keys(email: str, signature: str) -> tuple[list, str]:
+    """
+    The candidate keys for a signature and the signature without its key ID.
+    The index is per worker process, so every key is loaded once per worker.
+    """
+    kid, signature = split_signature(signature)
+    if kid is None:
+        return public_key_index.get_all(email), signature
+
+    public_key = public_key_index.get(email, kid)
+    return ([public_key] if public_key is not None else []), signature
+
+
+def verify_message(source: str, raw: bytes | None) -> list[dict]:
+    try:
+        if raw is None:
+            with open(source, 'rb') as f:
+                raw = f.read()
+
+        message = BytesParser(policy=policy.default).parsebytes(raw)
+        body = message.get_body(preferencelist=('html',))
+        signatures = extract_signatures(body.get_content()) if body else []
+    except Exception as e:
+        return [{"source": source, "status": "error", "error": str(e)}]
+
+    message_id = message.get('Message-ID')
+    if not signatures:
+        return [{"source": source, "message_id": message_id, "status": "no_signature"}]
+
+    results = []
+    for params in signatures:
+        result = {
+            "source": source,
+            "message_id": message_id,
+            "email": params['email'],
+            "sig_message": params['message'],
+            "signature": params['signature'],
+        }
+        try:
+            public_keys, signature = get_public_keys(params['email'], params['signature'])
+            if not public_keys:
+                result["status"] = "no_key"
+            elif any(verify_with_public_key(key, params['message'], signature) for key in public_keys):
+                result["status"] = "valid"
+            else:
+                result["status"] = "invalid"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+        results.append(result)
+    return results
+
+
+def verify_batch(batch: list[tuple[str, bytes | None]]) -> list[dict]:
+    results = []
+    for source, raw in batch:
+        results += verify_message(source, raw)
+    return results
+
+
+def iter_batches(items, batch_size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(paths: list[str], output, workers: int, batch_size: int) -> dict:
+    counts = {}
+    messages = 0
+    started = time.perf_counter()
+
+    def write_results(results):
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    # Keep a bounded number of batches in flight so large archives are streamed
+    max_pending = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for batch in iter_batches(iter_sources(paths), batch_size):
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write_results(future.result())
+            pending.add(executor.submit(verify_batch, batch))
+            messages += len(batch)
+
+        for future in wait(pending).done:
+            write_results(future.result())
+
+    elapsed = time.perf_counter() - started
+    return {
+        "messages": messages,
+        "results": counts,
+        "elapsed": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 1) if elapsed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify the signatures of archived emails.")
+    parser.add_argument('paths', nargs='+', help=".eml files, mbox files, Maildir folders or folders of those")
+    parser.add_argument('-o', '--output', help="JSONL report file (default: stdout)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument('-b', '--batch-size', type=int, default=32, help="Messages sent to a worker at a time")
+    args = parser.parse_args()
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        summary = run(args.paths, output, args.workers, args.batch_size)
+    finally:
+        if args.output:
+            output.close()
+
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 from pathlib import Path
-from fastapi import FastAPI
+from uuid import uuid4
+from fastapi import FastAPI, Request
 import sys
 import os
 import uvicorn
+from anyio.to_thread import current_default_thread_limiter
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.openapi.docs import get_swagger_ui_html
 from starlette.staticfiles import StaticFiles
 
@@ -13,7 +16,13 @@ email_path = os.path.join(path_root, 'email')
 sys.path.append(os.path.join(path_root))
 sys.path.append(email_path)
 
+from backend.log import request_id, setup_logging
+
+setup_logging()
+
 from routes import router
+from backend.smtp_relay import SMTP_RELAY_PORT, start_smtp_relay
+from backend.health import check_readiness
 
 description = """
 
@@ -67,10 +76,41 @@ app.add_middleware(
 app.include_router(router)
 
 
+@app.middleware("http")
+async def add_request_id(request: Request, call_next):
+    correlation_id = request.headers.get("X-Request-ID") or uuid4().hex
+    token = request_id.set(correlation_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id.reset(token)
+    response.headers["X-Request-ID"] = correlation_id
+    return response
+
+
+@app.on_event("startup")
+def start_relay():
+    app.state.smtp_relay = start_smtp_relay() if SMTP_RELAY_PORT else None
+
+
+@app.on_event("shutdown")
+def stop_relay():
+    if app.state.smtp_relay:
+        app.state.smtp_relay.stop()
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+
+@app.get("/health/ready")
+async def ready():
+    # Sync routes run on this limiter's threads
+    limiter = current_default_thread_limiter()
+    readiness = check_readiness(limiter.borrowed_tokens, int(limiter.total_tokens))
+    return JSONResponse(readiness, status_code=200 if readiness["status"] == "ready" else 503)
+
 if __name__ == "__main__":
     from fastapi import FastAPI
     uvicorn.run(app, host="0.0.0.0", port=1234)
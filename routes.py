@@ -1,14 +1,17 @@
+import logging
 from typing import Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, File, Form, UploadFile
 from pathlib import Path
 import sys
 import os
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+from cryptography.hazmat.primitives import serialization
 import base64
 from dotenv import load_dotenv
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 ENV = os.getenv("ENV", "development")
 SELF_URL = os.getenv('SELF_URL')
@@ -22,16 +25,16 @@ if ENV == "development":
     sys.path.append(os.path.join(path_root))
     sys.path.append(os.path.join(path_root, 'backend'))
 else:
-    print("Production")
-    print(os.getcwd())
-    print(os.path.dirname(__file__))
-    print(os.listdir('/'))
+    logger.info("Production", extra={"cwd": os.getcwd(), "module_dir": os.path.dirname(__file__)})
     sys.path.append('/')
     sys.path.append('/backend')
 
 
-from backend.signer import Signer, SignatureType, SMTPConfig, UserConfig, EmailConfig
-from backend.rsa import RSA, verify_by_base64_key
+from backend.signer import Signer, SignatureType, SMTPConfig, UserConfig, EmailConfig, SMTP_PROVIDERS, \
+    Attachment, MessageTooLargeError, InvalidMessageBodyError, InvalidAttachmentError
+from backend.rsa import RSA, verify_by_base64_key, verify_by_key_index, public_key_index
+from backend.smtp_pool import get_smtp_pool
+from backend.metrics import send_metrics
 
 router = APIRouter()
 
@@ -72,8 +75,7 @@ def convert_recipients(recipients):
 
 
 def verify_by_email(email: str, ps_message: str, ps_signature: str) -> bool:
-    rsa = RSA(email)
-    return rsa.verify(ps_signature, ps_message)
+    return verify_by_key_index(email, ps_message, ps_signature)
 
 
 @router.get("/")
@@ -82,14 +84,25 @@ def read_root():
 
 
 @router.get("/key")
-def get_public_key(user_email: str):
+def get_public_key(user_email: str, kid: Optional[str] = None):
     try:
+        if kid:
+            public_key = public_key_index.get(user_email, kid)
+            if public_key is None:
+                return {"status": "notfound", "error": "No key found for user", "public_key": "", "kid": kid}
+
+            key_str = public_key.public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo
+            ).decode('utf-8')
+            return {"status": "ok", "public_key": key_str, "error": "", "kid": kid}
+
         if not RSA.is_user_key_present(user_email):
             return {"status": "notfound", "error": "No key found for user", "public_key": ""}
 
         rsa = RSA(user_email)
         key_str = rsa.get_public_key()
-        return {"status": "ok", "public_key": key_str, "error": ""}
+        return {"status": "ok", "public_key": key_str, "error": "", "kid": rsa.kid}
     except Exception as e:
         return {"status": "error", "error": str(e), "public_key": ""}
 
@@ -134,7 +147,7 @@ def verify_email(email: str, ps_message: str, ps_signature: str):
             }
         }
     except Exception as e:
-        print(f"Error verifying email: {e}")
+        logger.warning("Error verifying email: %s", e)
         return {
             "email": email,
             "ps_message": ps_message,
@@ -158,12 +171,11 @@ def verify_key(verify_model: KeyVerifyModel):
     return {"verified": False}
 
 
-@router.post("/send/{provider}")
-def send_email(provider: str, send_model: SendModel):
-    if provider not in ['gmail', 'outlook']:
-        print(f"Invalid provider: {provider}")
+def send(provider: str, send_model: SendModel, attachments: list[Attachment] = None):
+    if provider not in SMTP_PROVIDERS:
+        logger.warning("Invalid provider: %s", provider)
         return {"error": "Invalid provider"}
-    server = 'smtp.gmail.com' if provider == 'gmail' else 'smtp.office365.com'
+    server = SMTP_PROVIDERS[provider]
     user_config = UserConfig(
         send_model.name,
         send_model.email,
@@ -178,36 +190,79 @@ def send_email(provider: str, send_model: SendModel):
     bcc = convert_recipients(send_model.bcc)
     subject = send_model.subject
     message_body = send_model.message_body
-    email_config = EmailConfig(
-        subject,
-        message_body,
-        [recipients] if isinstance(recipients, str) else recipients,
-        [cc] if isinstance(cc, str) else cc,
-        [bcc] if isinstance(bcc, str) else bcc,
-        send_model.reply_to
-    )
+    try:
+        email_config = EmailConfig(
+            subject,
+            message_body,
+            [recipients] if isinstance(recipients, str) else recipients,
+            [cc] if isinstance(cc, str) else cc,
+            [bcc] if isinstance(bcc, str) else bcc,
+            send_model.reply_to,
+            attachments=attachments
+        )
+    except MessageTooLargeError as e:
+        logger.warning("Message too large: %s", e)
+        return {"sent": False, "error": str(e)}
+    except InvalidMessageBodyError as e:
+        logger.warning("Invalid message body: %s", e)
+        return {"sent": False, "error": str(e)}
+
+    try:
+        if not email_config.is_valid():
+            logger.warning("Invalid email configuration: %s", email_config)
+            return {"error": "Invalid email configuration"}
+
+        smp_config = SMTPConfig(server, 587)
+        signer = Signer(
+            user_config,
+            smp_config,
+            os.path.join('backend', 'email.html'),
+            FRONTEND_URL,
+            SignatureType.SIMPLE,
+            smtp_pool=get_smtp_pool()
+        )
+
+        if ENV == "dev":
+            logger.info("Development mode")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Message: %s", email_config.message_body)
+            logger.info("Sending email: %s", email_config)
+            return {"sent": True, "message": "TEST Email sent"}
+
+        with send_metrics.track():
+            result = signer.send_email(email_config)
+        if result.success:
+            return {"sent": True, "message": result.response}
+
+        return {"sent": False, "error": result.error}
+    finally:
+        email_config.close()
 
-    if not email_config.is_valid():
-        print(f"Invalid email configuration: {email_config}")
-        return {"error": "Invalid email configuration"}
-
-    smp_config = SMTPConfig(server, 587)
-    signer = Signer(
-        user_config,
-        smp_config,
-        os.path.join('backend', 'email.html'),
-        FRONTEND_URL,
-        SignatureType.SIMPLE
-    )
 
-    if ENV == "dev":
-        print("Development mode")
-        print("Message: ", email_config.message_body)
-        print(f"Sending email: {email_config}")
-        return {"sent": True, "message": "TEST Email sent"}
+@router.post("/send/{provider}")
+def send_email(provider: str, send_model: SendModel):
+    return send(provider, send_model)
+
+
+@router.post("/send/{provider}/attachments")
+def send_email_with_attachments(
+        provider: str,
+        payload: str = Form(..., description="The SendModel as JSON"),
+        attachments: list[UploadFile] = File(default=[]),
+):
+    """
+    Same as `/send/{provider}`, but as multipart form data so files can be attached.
+    Uploads are spooled to temporary files and streamed into the message.
+    """
+    try:
+        send_model = SendModel.model_validate_json(payload)
+    except ValidationError as e:
+        return {"sent": False, "error": str(e)}
 
-    result = signer.send_email(email_config)
-    if result.success:
-        return {"sent": True, "message": result.response}
+    try:
+        attachments = [Attachment(upload.filename, upload.content_type, upload.file) for upload in attachments]
+    except InvalidAttachmentError as e:
+        logger.warning("Invalid attachment: %s", e)
+        return {"sent": False, "error": str(e)}
 
-    return {"sent": False, "error": result.error}
+    return send(provider, send_model, attachments)
@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root))
+sys.path.append(os.path.join(path_root, 'backend'))
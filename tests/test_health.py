@@ -0,0 +1,91 @@
+import types
+
+import pytest
+
+from backend import metrics
+
+health = pytest.importorskip('backend.health')
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def perf_counter(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(metrics, 'time', types.SimpleNamespace(perf_counter=clock.perf_counter,
+                                                               monotonic=clock.monotonic))
+    return clock
+
+
+def record_send(send_metrics, clock, seconds: float):
+    with send_metrics.track():
+        clock.now += seconds
+
+
+def test_p95_only_counts_recent_sends(clock):
+    send_metrics = metrics.SendMetrics()
+    for _ in range(20):
+        record_send(send_metrics, clock, 60)
+    assert send_metrics.p95(300) == 60
+
+    clock.now += 301
+    assert send_metrics.p95(300) is None
+    assert send_metrics.p95() == 60
+
+    record_send(send_metrics, clock, 1)
+    assert send_metrics.p95(300) == 1
+
+
+def test_p95_of_most_recent_sends(clock):
+    send_metrics = metrics.SendMetrics(window=100)
+    for seconds in range(1, 201):
+        record_send(send_metrics, clock, seconds / 100)
+    assert send_metrics.p95() == pytest.approx(1.96)
+
+
+@pytest.fixture
+def readiness(monkeypatch, clock, tmp_path):
+    send_metrics = metrics.SendMetrics()
+    monkeypatch.setattr(health, 'send_metrics', send_metrics)
+    monkeypatch.setattr(health, 'KEYS_DIR', str(tmp_path))
+    return send_metrics
+
+
+def test_ready(readiness):
+    result = health.check_readiness(threads_in_use=1, threads_total=10)
+    assert result["status"] == "ready"
+    assert result["reasons"] == []
+
+
+def test_not_ready_when_saturated_and_recovers(readiness, clock):
+    result = health.check_readiness(threads_in_use=10, threads_total=10)
+    assert result["reasons"] == ["thread pool is saturated"]
+
+    for _ in range(5):
+        record_send(readiness, clock, health.READY_MAX_P95_SECONDS + 1)
+    result = health.check_readiness(threads_in_use=1, threads_total=10)
+    assert result["status"] == "not-ready"
+    assert result["reasons"] == ["p95 send latency is too high"]
+
+    # The slow sends age out without any new send
+    clock.now += health.READY_LATENCY_WINDOW_SECONDS + 1
+    assert health.check_readiness(threads_in_use=1, threads_total=10)["status"] == "ready"
+
+
+def test_missing_key_store_is_not_ready(readiness, monkeypatch, tmp_path):
+    missing = tmp_path / 'keys' / 'private'
+    monkeypatch.setattr(health, 'KEYS_DIR', str(missing))
+
+    result = health.check_readiness(threads_in_use=1, threads_total=10)
+
+    assert result["reasons"] == ["key store is not accessible"]
+    assert not missing.exists()
@@ -0,0 +1,59 @@
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler
+
+import pytest
+
+# Logging reads its settings with python-dotenv
+log = pytest.importorskip('backend.log')
+
+
+class CountingArgument:
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return 'argument'
+
+
+@pytest.fixture
+def queued_logger():
+    log_queue = queue.SimpleQueue()
+    handler = QueueHandler(log_queue)
+    handler.addFilter(log.RequestIdFilter())
+    handler.addFilter(log.DebugSamplingFilter(0))
+    logger = logging.getLogger('tests.log')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(handler)
+    yield logger, handler, log_queue
+    logger.removeHandler(handler)
+
+
+def test_dropped_debug_records_are_never_formatted(queued_logger):
+    logger, handler, log_queue = queued_logger
+    argument = CountingArgument()
+    record = logger.makeRecord(logger.name, logging.DEBUG, __file__, 0, "Sampled out %s", (argument,), None)
+
+    # Straight to the handler, pytest formats every record it captures
+    handler.handle(record)
+
+    assert log_queue.empty()
+    assert argument.formatted == 0
+
+
+def test_json_formatter_adds_request_id_and_extra_fields(queued_logger):
+    logger, _, log_queue = queued_logger
+    token = log.request_id.set('abc')
+    try:
+        logger.info("Sent %s", 'mail', extra={"recipients": 2})
+    finally:
+        log.request_id.reset(token)
+
+    entry = json.loads(log.JsonFormatter().format(log_queue.get_nowait()))
+    assert entry["message"] == "Sent mail"
+    assert entry["level"] == "INFO"
+    assert entry["request_id"] == 'abc'
+    assert entry["recipients"] == 2
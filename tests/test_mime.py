@@ -0,0 +1,140 @@
+import base64
+import re
+from email import policy
+from email.parser import BytesParser
+from io import BytesIO
+
+import pytest
+
+from backend.mime import (
+    CRLF, Base64Encoder, EncodedSegment, MimePart, SMTPDataWriter, StreamingMessage, encode_filename,
+    normalize_content_type,
+)
+
+BARE_LINE_BREAK = re.compile(rb'\r(?!\n)|(?<!\r)\n')
+
+
+class FakeServer:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data: bytes):
+        self.sent.append(data)
+
+    @property
+    def data(self) -> bytes:
+        return b''.join(self.sent)
+
+
+def undo_dot_stuffing(data: bytes) -> bytes:
+    assert data.endswith(CRLF + b'.' + CRLF)
+    payload = data[:-len(b'.' + CRLF)]
+    lines = payload.split(CRLF)
+    return CRLF.join(line[1:] if line.startswith(b'.') else line for line in lines)
+
+
+def write_message(message: StreamingMessage, buffer_size: int = 64) -> bytes:
+    server = FakeServer()
+    writer = SMTPDataWriter(server, buffer_size=buffer_size)
+    message.write_to(writer.write)
+    writer.finish()
+    return server.data
+
+
+@pytest.mark.parametrize('chunk_size', [1, 56, 57, 58, 1000])
+def test_base64_encoder_matches_encodebytes(chunk_size):
+    data = bytes(range(256)) * 13
+    chunks = []
+    encoder = Base64Encoder(chunks.append)
+    for offset in range(0, len(data), chunk_size):
+        encoder.feed(data[offset:offset + chunk_size])
+    encoder.close()
+    assert b''.join(chunks) == base64.encodebytes(data).replace(b'\n', CRLF)
+
+
+def test_data_writer_dot_stuffing():
+    server = FakeServer()
+    writer = SMTPDataWriter(server, buffer_size=4)
+    writer.write(b'.first\r\n')
+    writer.write(b'.')
+    writer.write(b'second\r\n.')
+    writer.write(b'.third')
+    writer.finish()
+    assert server.data == b'..first\r\n..second\r\n...third\r\n.\r\n'
+
+
+def test_data_writer_terminator_at_line_start():
+    server = FakeServer()
+    writer = SMTPDataWriter(server)
+    writer.write(b'body' + CRLF)
+    writer.finish()
+    assert server.data == b'body\r\n.\r\n'
+
+
+def test_streaming_message_round_trip():
+    html = '<p>Hello</p>\r\n.\r\n.leading dot\rbare CR\n日本語 '
+    attachment = bytes(range(256)) * 300 + b'\r\n.\r\n'
+    message = StreamingMessage('mixed', [
+        ('From', 'sender@example.com'),
+        ('To', 'a@example.com,b@example.com'),
+        ('Subject', 'Résumé of the week'),
+    ], [
+        MimePart('text/html', [EncodedSegment('<html>'), html, BytesIO(b'<b>file</b>'), EncodedSegment('</html>')],
+                 charset='utf-8'),
+        MimePart('application/octet-stream', [BytesIO(attachment)], filename='résumé.bin'),
+        MimePart('text/plain', [b'.'], filename='dot.txt'),
+    ])
+
+    data = write_message(message)
+    assert not BARE_LINE_BREAK.search(data)
+    assert b'\r\n.\r\n' not in data[:-len(b'.' + CRLF)]
+
+    parsed = BytesParser(policy=policy.default).parsebytes(undo_dot_stuffing(data))
+    assert parsed['Subject'] == 'Résumé of the week'
+    assert parsed['To'] == 'a@example.com, b@example.com'
+    assert parsed['Bcc'] is None
+
+    body, binary, text = parsed.iter_parts()
+    expected_html = '<html>' + html + '<b>file</b></html>'
+    expected_html = expected_html.replace('\r\n', '\n').replace('\r', '\n')
+    assert body.get_content().replace('\r\n', '\n') == expected_html
+    assert binary.get_filename() == 'résumé.bin'
+    assert binary.get_payload(decode=True) == attachment
+    assert text.get_payload(decode=True) == b'.'
+
+
+def test_streaming_message_as_bytes_matches_writer_payload():
+    message = StreamingMessage('alternative', [('Subject', 'Same')], [
+        MimePart('text/html', ['.a\n.b'], charset='utf-8'),
+    ])
+    data = write_message(message, buffer_size=1)
+    expected = message.as_bytes()
+    # Date and Message-ID differ between two serialisations
+    strip = re.compile(rb'^(Date|Message-ID): .*\r\n', re.MULTILINE)
+    assert strip.sub(b'', undo_dot_stuffing(data)) == strip.sub(b'', expected)
+
+
+@pytest.mark.parametrize('filename', ['report.pdf', 'a "q".pdf', 'back\\slash.txt', 'résumé.pdf', '日本.txt'])
+def test_filename_round_trip(filename):
+    message = StreamingMessage('mixed', [], [MimePart('text/plain', [b'x'], filename=filename)])
+    part, = BytesParser(policy=policy.default).parsebytes(message.as_bytes()).iter_parts()
+    assert part.get_filename() == filename
+
+
+@pytest.mark.parametrize('filename', ['a.pdf\r\nBcc: x@example.com', 'a\nb', 'a\x00b'])
+def test_filename_with_control_characters_is_rejected(filename):
+    with pytest.raises(ValueError):
+        encode_filename(filename)
+
+
+@pytest.mark.parametrize('content_type, expected', [
+    ('image/png', 'image/png'),
+    ('Text/Plain; charset=utf-8', 'text/plain'),
+    ('application/vnd.ms-excel', 'application/vnd.ms-excel'),
+    ('image/png\r\nBcc: x@example.com', 'application/octet-stream'),
+    ('png', 'application/octet-stream'),
+    ('', 'application/octet-stream'),
+    (None, 'application/octet-stream'),
+])
+def test_normalize_content_type(content_type, expected):
+    assert normalize_content_type(content_type) == expected
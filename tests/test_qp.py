@@ -0,0 +1,65 @@
+import binascii
+import re
+
+import pytest
+
+from backend.mime import CRLF, EncodedSegment, MimePart, QuotedPrintableEncoder, encode_qp
+
+BARE_LINE_BREAK = re.compile(rb'\r(?!\n)|(?<!\r)\n')
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'a\rb', b'a\r\nb=\r\n'),
+    (b'a\nb', b'a\r\nb=\r\n'),
+    (b'a\r\nb', b'a\r\nb=\r\n'),
+    (b'a\r\n', b'a\r\n'),
+    (b'a \r\nb', b'a=20\r\nb=\r\n'),
+    (b'a\t', b'a=09=\r\n'),
+    (b'', b''),
+])
+def test_encode_qp(data, expected):
+    assert encode_qp(data) == expected
+
+
+@pytest.mark.parametrize('data', [
+    b'\r\r\n\n\r',
+    b'line \r\n.dot\rbare \n\ttab\t',
+    'café = 日本\r\n'.encode('utf-8') * 40,
+    b'x' * 300 + b' ',
+])
+def test_encode_qp_has_no_bare_line_breaks(data):
+    encoded = encode_qp(data)
+    assert not BARE_LINE_BREAK.search(encoded)
+    assert all(len(line) <= 76 for line in encoded.split(CRLF))
+    normalized = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    assert binascii.a2b_qp(encoded.replace(CRLF, b'\n')) == normalized
+
+
+def test_qp_encoder_keeps_crlf_split_between_chunks():
+    chunks = []
+    encoder = QuotedPrintableEncoder(chunks.append)
+    encoder.feed(b'a\r')
+    encoder.feed(b'\nb\r')
+    encoder.close()
+    encoded = b''.join(chunks)
+    assert not BARE_LINE_BREAK.search(encoded)
+    assert binascii.a2b_qp(encoded.replace(CRLF, b'\n')) == b'a\nb\n'
+
+
+def test_encoded_segment_keeps_its_encoded_form():
+    segment = EncodedSegment('<p>Café</p>\n')
+    assert segment.raw == '<p>Café</p>\n'.encode('utf-8')
+    assert segment.qp == encode_qp(segment.raw)
+
+
+@pytest.mark.parametrize('content, encoding', [
+    (['<p>Mostly ASCII text</p>' * 100], 'quoted-printable'),
+    ([EncodedSegment('<html>' * 100), '<p>body</p>'], 'quoted-printable'),
+    (['日本語のテキスト' * 100], 'base64'),
+])
+def test_choose_encoding_picks_the_smaller_one(content, encoding):
+    assert MimePart('text/html', content, charset='utf-8').choose_encoding() == encoding
+
+
+def test_binary_parts_are_base64():
+    assert MimePart('application/pdf', [b'%PDF' * 100]).choose_encoding() == 'base64'
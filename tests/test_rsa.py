@@ -0,0 +1,122 @@
+import base64
+import os
+
+import pytest
+
+# Key handling needs cryptography
+rsa = pytest.importorskip('backend.rsa')
+
+RSA = rsa.RSA
+
+
+@pytest.fixture(autouse=True)
+def key_dir(tmp_path, monkeypatch):
+    # Keys are kept relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_split_signature():
+    assert rsa.split_signature('abcd1234.ff00') == ('abcd1234', 'ff00')
+    assert rsa.split_signature('ff00') == (None, 'ff00')
+
+
+@pytest.mark.parametrize('kid, valid', [
+    ('abcd1234', True),
+    ('ABCD1234', False),
+    ('abcd123', False),
+    ('../../x/y', False),
+    (None, False),
+])
+def test_is_valid_key_id(kid, valid):
+    assert rsa.is_valid_key_id(kid) is valid
+
+
+@pytest.mark.parametrize('email, valid', [
+    ('user@example.com', True),
+    ('/some/dir', False),
+    ('..\\\\windows', False),
+    ('user@exa\0mple.com', False),
+    ('@.', False),
+    ('', False),
+])
+def test_is_valid_key_email(email, valid):
+    assert rsa.is_valid_key_email(email) is valid
+
+
+def test_rotated_key_still_verifies_old_signatures():
+    email = 'rotate@example.com'
+    old_key = RSA(email)
+    old_signature = old_key.create_signed_message('old message')
+
+    new_kid = RSA.rotate(email)
+    new_signature = RSA(email).create_signed_message('new message')
+
+    assert new_kid != old_key.kid
+    assert new_signature.startswith(f"{new_kid}.")
+    assert rsa.verify_by_key_index(email, 'old message', old_signature)
+    assert rsa.verify_by_key_index(email, 'new message', new_signature)
+    assert not rsa.verify_by_key_index(email, 'new message', old_signature)
+    assert not RSA(email).verify(old_signature, 'old message')
+
+
+def test_wrong_key_id_is_rejected():
+    email = 'wrong-kid@example.com'
+    key = RSA(email)
+    signature = key.create_signed_message('message')
+    other_kid = RSA.rotate(email)
+    _, hex_signature = rsa.split_signature(signature)
+
+    assert not rsa.verify_by_key_index(email, 'message', f"{other_kid}.{hex_signature}")
+    assert not rsa.verify_by_key_index(email, 'message', f"00000000.{hex_signature}")
+    assert not rsa.verify_by_key_index(email, 'message', f"../../x.{hex_signature}")
+
+
+def test_legacy_signature_verifies_with_any_key():
+    email = 'legacy@example.com'
+    key = RSA(email)
+    _, legacy_signature = rsa.split_signature(key.create_signed_message('legacy message'))
+    RSA.rotate(email)
+
+    assert len(rsa.public_key_index.get_all(email)) == 2
+    assert rsa.verify_by_key_index(email, 'legacy message', legacy_signature)
+    assert not rsa.verify_by_key_index(email, 'other message', legacy_signature)
+
+
+def test_legacy_key_is_exported_on_lookup(key_dir):
+    email = 'export@example.com'
+    key = RSA(email)
+    _, legacy_signature = rsa.split_signature(key.create_signed_message('message'))
+    # A key that predates key IDs has no public key file yet
+    os.remove(RSA.get_public_key_path(email, key.kid))
+
+    index = rsa.PublicKeyIndex()
+    assert index.get(email, key.kid) is None
+    assert len(index.get_all(email)) == 1
+    assert index.get(email, key.kid) is not None
+
+
+def test_public_key_index_never_leaves_the_key_directory(key_dir):
+    outside = key_dir / 'outside'
+    outside.mkdir()
+    RSA('victim@example.com')
+    # A valid looking key file outside of the public key directory
+    public_key_dir = RSA.get_public_key_dir('victim@example.com')
+    os.replace(os.path.join(public_key_dir, os.listdir(public_key_dir)[0]), outside / 'abcd1234.pem')
+
+    index = rsa.PublicKeyIndex()
+    assert index.get(str(outside), 'abcd1234') is None
+    assert index.get_all(str(outside)) == []
+    assert index.get('victim@example.com', '../../outside/abcd1234') is None
+    with pytest.raises(ValueError):
+        RSA.get_public_key_dir(str(outside))
+
+
+def test_verify_by_base64_key_accepts_key_ids():
+    key = RSA('base64@example.com')
+    signature = key.create_signed_message('message')
+    base64_key = base64.b64encode(key.get_public_key().encode()).decode()
+
+    assert rsa.verify_by_base64_key(base64_key, 'message', signature)
+    assert rsa.verify_by_base64_key(base64_key, 'message', rsa.split_signature(signature)[1])
+    assert not rsa.verify_by_base64_key(base64_key, 'message', 'not hex')
@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+
+import pytest
+
+# The batch sender needs the service dependencies (cryptography, bs4, pyperclip, dotenv)
+send = pytest.importorskip('backend.send')
+
+
+@pytest.fixture
+def fake_sender(monkeypatch):
+    """
+    Replaces signing and sending. The verifications carry the line number, so the
+    fake send knows which record it sends. Returns the sent line numbers.
+    """
+    sent = []
+    lock = threading.Lock()
+    failing = set()
+
+    def prepare(self, record):
+        if 'line' not in record:
+            raise ValueError("Missing fields: line")
+        return object(), record
+
+    def sign(prepared):
+        return [{'line': email_config['line']} for _, _, email_config in prepared]
+
+    def fake_send(signer, email_config, verifications):
+        time.sleep(0.02)
+        if verifications['line'] in failing:
+            return "Refused"
+        with lock:
+            sent.append(verifications['line'])
+        return None
+
+    monkeypatch.setattr(send.BatchSender, 'prepare', prepare)
+    monkeypatch.setattr(send.BatchSender, 'sign', staticmethod(sign))
+    monkeypatch.setattr(send.BatchSender, 'send', staticmethod(fake_send))
+    return sent, failing
+
+
+def write_records(path, lines):
+    path.write_text(''.join(f"{line}\n" for line in lines), encoding='utf-8')
+
+
+def test_iter_records_reports_invalid_lines(tmp_path):
+    records = tmp_path / 'records.jsonl'
+    write_records(records, ['{"line": 1}', '{"line": 2}', '', 'not json', '[]', '1', '"x"'])
+
+    results = list(send.iter_records(str(records), {1}))
+
+    assert results[0] == (2, {"line": 2}, None)
+    assert [(line_number, record) for line_number, record, _ in results[1:]] == [
+        (4, None), (5, None), (6, None), (7, None)
+    ]
+    assert results[1][2].startswith("Invalid JSON")
+    assert all(error.startswith("Record is not a JSON object") for _, _, error in results[2:])
+
+
+def test_run_resumes_from_checkpoint(tmp_path, fake_sender):
+    sent, failing = fake_sender
+    records = tmp_path / 'records.jsonl'
+    checkpoint = tmp_path / 'records.jsonl.checkpoint'
+    write_records(records, [json.dumps({"line": line_number}) for line_number in range(1, 6)] + ['[]'])
+    failing.add(3)
+
+    summary = send.run(str(records), str(checkpoint), 'outlook', concurrency=2, sign_batch=2)
+
+    assert (summary["sent"], summary["failed"], summary["skipped"]) == (4, 2, 0)
+    assert send.read_checkpoint(str(checkpoint)) == {1, 2, 4, 5}
+
+    failing.clear()
+    sent.clear()
+    summary = send.run(str(records), str(checkpoint), 'outlook', concurrency=2, sign_batch=2)
+
+    assert sent == [3]
+    assert (summary["sent"], summary["failed"], summary["skipped"]) == (1, 1, 4)
+    assert send.read_checkpoint(str(checkpoint)) == {1, 2, 3, 4, 5}
+
+
+def test_interrupted_run_checkpoints_running_sends(tmp_path, monkeypatch, fake_sender):
+    sent, _ = fake_sender
+    checkpoint = tmp_path / 'records.checkpoint'
+
+    def interrupted_records(records_path, done):
+        for line_number in range(1, 41):
+            yield line_number, {"line": line_number}, None
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(send, 'iter_records', interrupted_records)
+
+    with pytest.raises(KeyboardInterrupt):
+        send.run('records.jsonl', str(checkpoint), 'outlook', concurrency=4, sign_batch=40)
+
+    # The queued sends are dropped, every send that ran is in the checkpoint
+    assert len(sent) < 40
+    assert send.read_checkpoint(str(checkpoint)) == set(sent)
@@ -0,0 +1,88 @@
+import base64
+import urllib.parse
+from io import BytesIO
+
+import pytest
+
+# The signer needs the service dependencies (cryptography, bs4, pyperclip, dotenv)
+signer = pytest.importorskip('backend.signer')
+
+
+def encode_body(text: str, wrap: bool = False) -> str:
+    quoted = urllib.parse.quote(text).encode()
+    encoded = base64.encodebytes(quoted) if wrap else base64.b64encode(quoted)
+    return 'base64:' + encoded.decode()
+
+
+def read_body(body_file) -> str:
+    with body_file:
+        return body_file.read().decode('utf-8')
+
+
+BODIES = [
+    '',
+    'plain',
+    '<p>Hello, 世界 % 100%</p>\n' * 50,
+    'é' * 5000,
+]
+
+
+@pytest.mark.parametrize('text', BODIES)
+@pytest.mark.parametrize('wrap', [False, True])
+@pytest.mark.parametrize('chunk_size', [1, 3, 4, 5, 77, 64 * 1024])
+def test_atou_to_file_matches_atou(text, wrap, chunk_size):
+    b64 = encode_body(text, wrap)
+    assert read_body(signer.atou_to_file(b64, chunk_size=chunk_size)) == signer.atou(b64) == text
+
+
+def test_atou_to_file_large_wrapped_body():
+    text = '<div>Zażółć gęślą jaźń</div>\n' * 8000
+    b64 = encode_body(text, wrap=True)
+    assert len(b64) > 200 * 1024
+    assert read_body(signer.atou_to_file(b64)) == text
+
+
+@pytest.mark.parametrize('chunk_size', range(1, 13))
+def test_atou_to_file_percent_escape_split_between_chunks(chunk_size):
+    # Every offset of the escapes ends up at a chunk boundary for one of the sizes
+    text = 'a%b日c%%d'
+    b64 = encode_body(text)
+    assert read_body(signer.atou_to_file(b64, chunk_size=chunk_size)) == text
+
+
+def test_atou_to_file_without_prefix():
+    b64 = encode_body('no prefix')[len('base64:'):]
+    assert read_body(signer.atou_to_file(b64, has_prefix=False)) == 'no prefix'
+
+
+@pytest.mark.parametrize('b64', [
+    'base64:abc',
+    'base64:' + base64.b64encode(b'\xff\xfe').decode(),
+    'base64:' + base64.b64encode('日'.encode()[:2]).decode(),
+])
+def test_atou_to_file_invalid_body(b64):
+    with pytest.raises(signer.InvalidMessageBodyError):
+        signer.atou_to_file(b64)
+
+
+def test_atou_to_file_too_large(monkeypatch):
+    monkeypatch.setattr(signer, 'MAX_MESSAGE_BODY_SIZE', 10)
+    with pytest.raises(signer.MessageTooLargeError):
+        signer.atou_to_file(encode_body('x' * 100))
+
+
+def test_combine_recipients():
+    email_config = signer.EmailConfig('Subject', 'body', ['to@example.com'], None, ['hidden@example.com'],
+                                      decode_body=False)
+    assert email_config.combine_recipients() == ['to@example.com', 'hidden@example.com']
+
+    relayed = signer.EmailConfig('Subject', 'body', ['to@example.com'], decode_body=False,
+                                 envelope_recipients=['envelope@example.com'])
+    assert relayed.combine_recipients() == ['envelope@example.com']
+
+
+def test_attachment_validates_headers():
+    attachment = signer.Attachment('a.png', 'image/png\r\nX-Injected: 1', BytesIO(b'png'))
+    assert attachment.content_type == 'application/octet-stream'
+    with pytest.raises(signer.InvalidAttachmentError):
+        signer.Attachment('a.png\r\nX-Injected: 1', 'image/png', BytesIO(b'png'))
@@ -0,0 +1,51 @@
+import pytest
+
+# Signing needs cryptography and python-dotenv
+signing = pytest.importorskip('backend.signing')
+
+from rsa import RSA  # noqa: E402
+
+EMAIL = 'sender@example.com'
+
+
+@pytest.fixture(autouse=True)
+def key_dir(tmp_path, monkeypatch):
+    # Keys are kept relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+def test_sign_many_keeps_the_order_of_the_payloads(pool):
+    service = signing.SigningService(pool=pool, workers=2)
+    payloads = [f"payload-{index}" for index in range(7)]
+    try:
+        result = service.sign_many(EMAIL, payloads)
+    finally:
+        service.shutdown()
+
+    rsa = RSA(EMAIL)
+    assert len(result.signatures) == len(payloads)
+    assert all(rsa.verify(signature, payload) for signature, payload in zip(result.signatures, payloads))
+    assert not rsa.verify(result.signatures[0], payloads[1])
+    assert (service.signed, service.batches) == (len(payloads), 1)
+
+
+def test_sign_uses_the_rotated_key():
+    service = signing.SigningService(pool='thread', workers=1)
+    try:
+        old_kid = RSA(EMAIL).kid
+        old_signature = service.sign(EMAIL, 'before')
+        new_kid = RSA.rotate(EMAIL)
+        new_signature = service.sign(EMAIL, 'after')
+    finally:
+        service.shutdown()
+
+    assert old_signature.startswith(f"{old_kid}.")
+    assert new_signature.startswith(f"{new_kid}.")
+    assert old_kid != new_kid
+
+
+def test_split():
+    assert signing._split([1, 2, 3, 4, 5], 2) == [[1, 2, 3], [4, 5]]
+    assert signing._split([1], 4) == [[1]]
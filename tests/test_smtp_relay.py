@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import types
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
+
+import pytest
+
+# The relay needs the service dependencies (aiosmtpd, cryptography, bs4, pyperclip, dotenv)
+smtp_relay = pytest.importorskip('backend.smtp_relay')
+signer = pytest.importorskip('backend.signer')
+
+from aiosmtpd.smtp import LoginPassword  # noqa: E402
+
+
+class FakeSigningService:
+    def get_key(self, email: str):
+        pass
+
+
+def parse(data: bytes):
+    return BytesParser(policy=policy.default).parsebytes(data)
+
+
+def relayed_message() -> EmailMessage:
+    message = EmailMessage()
+    message['From'] = 'sender@example.com'
+    message['To'] = 'to@example.com'
+    message['Cc'] = 'header-only@example.com'
+    message['Subject'] = 'Report'
+    message.set_content('Report attached')
+    message.add_alternative('<p>Chart: <img src="cid:chart@example.com"></p>', subtype='html')
+    html = message.get_payload()[1]
+    html.add_related(b'PNG', maintype='image', subtype='png', cid='<chart@example.com>')
+    message.add_attachment(b'%PDF', maintype='application', subtype='pdf', filename='report.pdf')
+    return parse(message.as_bytes())
+
+
+def build_email_config(rcpt_tos: list[str]):
+    handler = smtp_relay.SigningRelayHandler(verify_url='https://example.com')
+    return handler.build_email_config(relayed_message(), rcpt_tos)
+
+
+def test_build_email_config_relays_to_envelope():
+    email_config = build_email_config(['to@example.com', 'hidden@example.com'])
+    try:
+        assert email_config.recipients == ['to@example.com']
+        assert email_config.cc == ['header-only@example.com']
+        assert email_config.bcc is None
+        assert email_config.combine_recipients() == ['to@example.com', 'hidden@example.com']
+        assert 'cid:chart@example.com' in email_config.message_body
+    finally:
+        email_config.close()
+
+
+def test_build_email_config_keeps_attachments_and_inline_parts():
+    email_config = build_email_config(['to@example.com'])
+    try:
+        attachments = {attachment.content_type: attachment for attachment in email_config.attachments}
+        assert set(attachments) == {'image/png', 'application/pdf'}
+        assert attachments['image/png'].content_id == 'chart@example.com'
+        assert attachments['image/png'].file.read() == b'PNG'
+        assert attachments['application/pdf'].content_id is None
+        assert attachments['application/pdf'].filename == 'report.pdf'
+    finally:
+        email_config.close()
+
+
+def test_relayed_message_keeps_inline_images_related_to_html():
+    email_config = build_email_config(['to@example.com', 'hidden@example.com'])
+    user = signer.UserConfig('Name', 'sender@example.com', 'password', 'Role', 'Name', 'Role')
+    sender = signer.Signer(user, signer.SMTPConfig(), 'email.html', 'https://example.com',
+                           signing_service=FakeSigningService())
+    signature = signer.Signature(['<html>'], ['</html>'], '', '', user.email)
+    try:
+        message = parse(sender.build_message(email_config, signature).as_bytes())
+    finally:
+        email_config.close()
+
+    assert message['Bcc'] is None
+    assert message.get_content_type() == 'multipart/mixed'
+    related, pdf = message.iter_parts()
+    assert related.get_content_type() == 'multipart/related'
+    html, image = related.iter_parts()
+    assert 'cid:chart@example.com' in html.get_content()
+    assert image['Content-ID'] == '<chart@example.com>'
+    assert image.get_content_disposition() == 'inline'
+    assert image.get_payload(decode=True) == b'PNG'
+    assert pdf.get_content_disposition() == 'attachment'
+    assert pdf.get_filename() == 'report.pdf'
+
+
+class FakeSigner:
+    def __init__(self):
+        self.sent = []
+
+    def send_email(self, email_config):
+        self.sent.append((threading.current_thread(), email_config.combine_recipients(), email_config.subject))
+        return signer.SignerResponse(True, "Email sent successfully!", "")
+
+
+def relay(handler, message: EmailMessage, rcpt_tos: list[str], auth_data=LoginPassword(b'sender@example.com', b'pw')):
+    session = types.SimpleNamespace(auth_data=auth_data)
+    envelope = types.SimpleNamespace(original_content=message.as_bytes(), content=None, rcpt_tos=rcpt_tos)
+    return asyncio.run(handler.handle_DATA(None, session, envelope))
+
+
+def test_handle_data_relays_off_the_event_loop(monkeypatch):
+    fake_signer = FakeSigner()
+    handler = smtp_relay.SigningRelayHandler(verify_url='https://example.com')
+    monkeypatch.setattr(handler, '_SigningRelayHandler__get_signer', lambda user_config: fake_signer)
+    message = relayed_message()
+    for name, header in smtp_relay.SIGNATURE_HEADERS.items():
+        message[header] = name
+
+    reply = relay(handler, message, ['to@example.com'])
+
+    assert reply.startswith('250')
+    [(thread, recipients, subject)] = fake_signer.sent
+    assert thread is not threading.main_thread()
+    assert recipients == ['to@example.com']
+    assert subject == 'Report'
+
+
+def test_handle_data_rejects_missing_signature_headers():
+    handler = smtp_relay.SigningRelayHandler(verify_url='https://example.com')
+    assert relay(handler, relayed_message(), ['to@example.com']).startswith('550')
+    assert relay(handler, relayed_message(), ['to@example.com'], auth_data=None).startswith('530')
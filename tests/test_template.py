@@ -0,0 +1,48 @@
+import os
+from pathlib import Path
+
+import pytest
+
+# The signer needs the service dependencies (cryptography, bs4, pyperclip, dotenv)
+signer = pytest.importorskip('backend.signer')
+
+
+def test_compiled_template():
+    template = signer.CompiledTemplate(
+        f'<p>{{{{ main_name }}}}</p>{signer.BODY_PLACEHOLDER}<i>{{{{ signature }}}} {{{{ unknown }}}}</i>'
+    )
+    head, tail = template.render({'main_name': 'Ada', 'signature': 'abcd1234.ff'})
+    render = signer.Signature(head, tail, '', '', '').render
+    assert render('<b>body</b>') == '<p>Ada</p><b>body</b><i>abcd1234.ff {{ unknown }}</i>'
+    assert all(isinstance(segment, signer.EncodedSegment) for segment in head[::2])
+
+
+def test_minify_html_keeps_body_placeholder():
+    html = f'<div>\n  <!-- comment -->\n  {signer.BODY_PLACEHOLDER}\n</div>\n<style> a {{ color: red; }} </style>'
+    assert signer.minify_html(html) == f'<div> {signer.BODY_PLACEHOLDER} </div> <style>a{{color:red;}}</style>'
+
+
+def test_simple_template_renders_every_field(monkeypatch):
+    # The template paths are relative to the repository root
+    monkeypatch.chdir(Path(__file__).parents[1])
+    template = signer.load_simple_template(os.path.join('backend', 'email.html'))
+    fields = signer.create_fields('Name', 'sender@example.com', 'Role')
+    fields.update({
+        'latin_name': 'Latin Name',
+        'latin_role': 'Latin Role',
+        'signature': 'abcd1234.ff',
+        'verified_title': 'abcd1234.ff',
+        'sig_message': 'id-message',
+        'verify_url': 'https://example.com',
+        'subject': 'Subject',
+    })
+
+    head, tail = template.render(fields)
+    html = signer.Signature(head, tail, '', '', '').render('<p>The body</p>')
+
+    assert '{{' not in html
+    assert '<p>The body</p>' in html
+    assert signer.BODY_PLACEHOLDER not in html
+    assert all(value in html for value in fields.values())
+    # The template is compiled once per process
+    assert signer.load_simple_template(os.path.join('backend', 'email.html')) is template
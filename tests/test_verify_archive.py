@@ -0,0 +1,118 @@
+import io
+import json
+import os
+from email.message import EmailMessage
+
+import pytest
+
+# The archive verifier needs cryptography and bs4
+verify_archive = pytest.importorskip('backend.verify_archive')
+
+from backend.rsa import RSA  # noqa: E402
+
+EMAIL = 'sender@example.com'
+
+
+def verify_link(email: str, message: str, signature: str) -> str:
+    return f"https://example.com/email/verify?email={email}&message={message}&signature={signature}"
+
+
+def signed_html(message: str, signature: str) -> str:
+    return f'<p>Hi</p><a href="{verify_link(EMAIL, message, signature)}">Verify</a>'
+
+
+def make_email(html: str = None, message_id: str = '<1@example.com>') -> bytes:
+    message = EmailMessage()
+    message['Message-ID'] = message_id
+    message['Subject'] = 'Signed'
+    if html is None:
+        message.set_content('No signature')
+    else:
+        message.set_content(html, subtype='html')
+    return message.as_bytes()
+
+
+def write_maildir(path, messages: dict[str, bytes]):
+    for sub in ('cur', 'new', 'tmp'):
+        os.makedirs(path / sub)
+    for name, raw in messages.items():
+        (path / 'cur' / name).write_bytes(raw)
+
+
+def write_mbox(path, count: int):
+    path.write_bytes(b''.join(
+        b'From sender@example.com Thu Jan  1 00:00:00 2026\n' + make_email(message_id=f'<{index}@mbox>') + b'\n'
+        for index in range(count)
+    ))
+
+
+def test_parse_verify_link():
+    params = verify_archive.parse_verify_link(verify_link(EMAIL, 'id-2026%E5%B9%B4', 'abcd1234.ff'))
+    assert params == {"email": EMAIL, "message": 'id-2026年', "signature": 'abcd1234.ff'}
+    assert verify_archive.parse_verify_link('https://example.com/other?email=a&message=b&signature=c') is None
+    assert verify_archive.parse_verify_link('https://example.com/email/verify?email=a&message=b') is None
+
+
+def test_extract_signatures_restores_obfuscated_email():
+    html = signed_html('id-sender&#173;@example&#173;.com', 'ff') + signed_html('id-sender&#173;@example&#173;.com', 'ff')
+    assert verify_archive.extract_signatures(html) == [
+        {"email": EMAIL, "message": 'id-sender&#173;@example&#173;.com', "signature": 'ff'}
+    ]
+
+
+def test_iter_sources(tmp_path):
+    tree = tmp_path / 'tree'
+    tree.mkdir()
+    (tree / 'a.eml').write_bytes(make_email())
+    (tree / 'notes.txt').write_text('not a message')
+    write_mbox(tree / 'box.mbox', 2)
+    write_mbox(tree / 'Inbox', 1)
+    maildir = tmp_path / 'Maildir'
+    write_maildir(maildir, {'1': make_email()})
+    write_maildir(maildir / '.Sent', {'2': make_email()})
+    write_maildir(maildir / '.Archive', {'3': make_email()})
+    missing = str(tmp_path / 'missing.mbox')
+
+    sources = [source for source, _ in verify_archive.iter_sources([str(tree), str(maildir), missing])]
+
+    assert sources == [
+        str(tree / 'Inbox#0'),
+        str(tree / 'a.eml'),
+        str(tree / 'box.mbox#0'),
+        str(tree / 'box.mbox#1'),
+        str(maildir / 'cur' / '1'),
+        str(maildir / '.Archive' / 'cur' / '3'),
+        str(maildir / '.Sent' / 'cur' / '2'),
+        missing,
+    ]
+
+
+def test_run_verifies_and_reports_errors(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rsa = RSA(EMAIL)
+    old_signature = rsa.create_signed_message('old-message')
+    RSA.rotate(EMAIL)
+    new_signature = RSA(EMAIL).create_signed_message('new-message')
+    legacy_signature = old_signature.partition('.')[2]
+
+    mails = tmp_path / 'mails'
+    mails.mkdir()
+    (mails / 'old.eml').write_bytes(make_email(signed_html('old-message', old_signature)))
+    (mails / 'new.eml').write_bytes(make_email(signed_html('new-message', new_signature)))
+    (mails / 'legacy.eml').write_bytes(make_email(signed_html('old-message', legacy_signature)))
+    (mails / 'tampered.eml').write_bytes(make_email(signed_html('tampered', new_signature)))
+    (mails / 'plain.eml').write_bytes(make_email())
+    output = io.StringIO()
+
+    summary = verify_archive.run([str(mails), str(tmp_path / 'missing.eml')], output, workers=1, batch_size=2)
+
+    results = {os.path.basename(result["source"]): result for result in map(json.loads, output.getvalue().splitlines())}
+    assert summary["messages"] == 6
+    assert {name: result["status"] for name, result in results.items()} == {
+        'old.eml': 'valid',
+        'new.eml': 'valid',
+        'legacy.eml': 'valid',
+        'tampered.eml': 'invalid',
+        'plain.eml': 'no_signature',
+        'missing.eml': 'error',
+    }